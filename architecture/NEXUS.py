@@ -4,13 +4,45 @@ Handler for the network as a whole
 
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .cycle_plan import CyclePlan
+
 
 class Network:
 
-    def __init__(self, layers=(), projections=()):
+    def __init__(self, layers=(), projections=(), **kwargs):
 
         self.quarter_size = 25
 
+        ########### Early termination of the settling ###########
+
+        # Tolerance on the largest change of act or v_m_eq in a step. Once all layers change less than this, the
+        # quarter ends early, and during the minus phase the remaining minus-phase quarters are skipped. None to always
+        # run quarter_size steps
+        self.settle_tol = None
+        # Minimum number of steps of a quarter before it can end early
+        self.settle_min_steps = 5
+        # Maximum number of steps of a quarter (at most quarter_size), None for quarter_size. Applies even if settle_tol is
+        # None, and to every quarter_size steps of infer
+        self.settle_max_steps = None
+
+        # Run quarters with the fused cycle plan, instead of step by step
+        self.fused = False
+        # Compiled cycle plan, created when first needed
+        self.plan = None
+
+        # Number of threads stepping the projections and the layers. Above 1, projections transmit concurrently into
+        # their own input buffers, then layers step concurrently
+        self.n_threads = 1
+        # Thread pool, created on demand, and the process it was created in: a forked process gets a copy of the pool
+        # without its threads, and creates its own
+        self._pool = None
+        self._pool_pid = None
+
         # Number of steps that have finished in the current cycle
         self.step_count = 0
         # Total number of steps executed (not reset at end of cycle)
@@ -19,10 +51,17 @@ class Network:
         self.quarter_num = 1
         # Number of cycles finished overall
         self.cycle_count = 0
+        # Number of steps executed in the current cycle, fewer than 4 * quarter_size when settling ends quarters early
+        self.cycle_steps = 0
+        # If the network settled during the minus phase of the current cycle
+        self._minus_settled = False
 
         # Current phase
         self.phase = 'minus'
 
+        # Number of patterns simulated at once, set from the shape of the inputs at the start of every cycle
+        self.batch_size = None
+
         # Layers of the network
         self.layers = list(layers)
         # Projections between layers of the network
@@ -30,6 +69,10 @@ class Network:
         # Inputs and outputs of the network
         self._inputs, self._outputs = {}, {}
 
+        for key, value in kwargs.items():
+            assert hasattr(self, key), 'the {} parameter does not exist'.format(key)
+            setattr(self, key, value)
+
         # After initialization, build the network
         self.build()
 
@@ -53,6 +96,9 @@ class Network:
         # Add the layer to the network's layer master list
         self.layers.append(layer)
 
+        # Need to run "build" to reinitialize the network.
+        self.build()
+
     # Pre-compute necessary data structures
     # Network building must be done anytime network structure (synapses, projections, etc.) is changed
     def build(self):
@@ -67,10 +113,42 @@ class Network:
             for connection in layer.incoming_projections:
                 connection.wt_scale_rel_eff = connection.wt_scale_rel / rel_sum
 
+        # Incoming projections of every layer, as indices in the projection list: the order in which layers sum their
+        # inputs when stepping with threads
+        self.incoming = [[i for i, connection in enumerate(self.projections) if connection.post is layer]
+                         for layer in self.layers]
+
+        # Compile the cycle plan. It is compiled again whenever the layers, projections or neuron parameters change
+        if self.fused:
+            self.cycle_plan().update()
+
+        assert self.settle_max_steps is None or self.settle_max_steps <= self.quarter_size
+
 
     ################  Utility functions  ################
 
 
+    # Cycle plan running the fused quarters, created when first needed
+    def cycle_plan(self):
+        if self.plan is None:
+            self.plan = CyclePlan(self)
+        return self.plan
+
+    # Thread pool stepping the network, None for a single thread
+    def thread_pool(self):
+        if self.n_threads <= 1:
+            return None
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(self.n_threads)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    # The thread pool is not copied or pickled, but created again when first needed
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
     # Get a layer by its name. Name conflict returns oldest layer
     def _get_layer(self, name):
         for layer in self.layers:
@@ -82,7 +160,8 @@ class Network:
     def set_inputs(self, act_map):
 
         # TODO: Set inputs according to the act_map
-        # act_map = dictionary with layer names as keys, and activities arrays as values
+        # act_map = dictionary with layer names as keys, and activities arrays as values. A (batch, units) array runs
+        # all the patterns of the batch at once, through the same weights
         self._inputs = act_map
 
     # Set output activities, done at the beginning of all quarters
@@ -92,13 +171,25 @@ class Network:
         # act_map = dictionary with layer names as keys, and activities arrays as values
         self._outputs = act_map
 
-    # TODO: Compute the sum of squared error (SSE) for prediction. Runs after minus phase finishes
+    # Run a batch of patterns at once if the inputs or outputs are (batch, units) arrays, or a single pattern otherwise
+    def _update_batch_size(self):
+        batch_size = None
+        for activities in list(self._inputs.values()) + list(self._outputs.values()):
+            if np.ndim(activities) == 2:
+                batch_size = len(activities)
+
+        if batch_size != self.batch_size:
+            self.batch_size = batch_size
+            for layer in self.layers:
+                layer.set_batch_size(batch_size)
+
+    # TODO: Compute the sum of squared error (SSE) for prediction. Runs after minus phase finishes. One SSE per pattern
+    # when running batches
     def compute_sse(self):
 
         sse = 0
         for name, activities in self._outputs.items():
-            for act, neuron in zip(activities, self._get_layer(name).neurons):
-                sse += (act - neuron.act_m)**2
+            sse += np.sum((np.asarray(activities) - self._get_layer(name).act_m)**2, axis=-1)
         return sse
 
 
@@ -126,6 +217,10 @@ class Network:
 
             # If it's the start of a cycle
             if self.quarter_num == 1:
+                self.cycle_steps = 0
+                self._minus_settled = False
+                self._update_batch_size()
+
                 # Reset all layers
                 for layer in self.layers:
                     layer.cycle_init()
@@ -139,11 +234,19 @@ class Network:
                 for name, activities in self._outputs.items():
                     self._get_layer(name).force_activity(activities)
 
+            # Layers clamped for the whole quarter skip their steps
+            for layer in self.layers:
+                layer.freeze()
+
     # Check if network is at a special moment requiring action after executing the step
     def _post_step(self):
 
         # If it's the end of a quarter
         if self.step_count == self.quarter_size: # end of a quarter
+            # Layers that skipped their steps catch up
+            for layer in self.layers:
+                layer.unfreeze()
+
             # If it's the end of the minus phase, call the phase end handler
             if self.quarter_num == 3:
                 self.end_minus_phase()
@@ -164,27 +267,132 @@ class Network:
             self.quarter()
         return self.compute_sse()
 
+    # Inference only: settle the network on the inputs, and return the activities of the output layer (the last layer
+    # by default) at the end of the settling. Runs the minus phase, or n_steps steps (fewer if it settles, see
+    # settle_tol), without plus phase, learning or updates of the averages for learning. Must be called between cycles
+    def infer(self, inputs, n_steps=None, output=None):
+        assert (self.quarter_num, self.step_count) in ((1, 0), (4, self.quarter_size)), 'infer called during a cycle'
+        if n_steps is None:
+            n_steps = 3 * self.quarter_size
+
+        # Same initialization as the start of a cycle. The inputs of the training cycles are kept
+        train_inputs = self._inputs
+        self.set_inputs(inputs)
+        self._update_batch_size()
+        for layer in self.layers:
+            layer.cycle_init()
+        for name, activities in self._inputs.items():
+            self._get_layer(name).force_activity(activities)
+        for connection in self.projections:
+            connection.compute_netin_scaling()
+        for layer in self.layers:
+            layer.freeze()
+
+        # Settle, possibly ending early (see settle_tol). settle_max_steps caps every quarter: the settling is capped to
+        # as many times settle_max_steps as it has quarters
+        max_steps = None
+        if self.settle_max_steps is not None:
+            max_steps = -(-n_steps // self.quarter_size) * self.settle_max_steps
+
+        def settled(step):
+            return self._settled(step, max_steps)
+
+        if self.fused:
+            n_steps = self.cycle_plan().run(n_steps, minus=True, learning=False, settled=settled)
+        else:
+            for step in range(1, n_steps + 1):
+                self._step_all('minus', learning=False)
+                if step < n_steps and settled(step):
+                    n_steps = step
+                    break
+        self.total_steps += n_steps
+        self.cycle_steps = n_steps
+        for layer in self.layers:
+            layer.unfreeze()
+        self._inputs = train_inputs
+
+        # Activities at the end of the settling, as at the end of the minus phase
+        for layer in self.layers:
+            layer.act_m[:] = layer.act
+
+        output_layer = self.layers[-1] if output is None else self._get_layer(output)
+        return output_layer.act_m.copy()
+
     # Execute the functions that occur at a quarter-step
     def quarter(self):
 
+        # Settled during the minus phase: the remaining quarters of the minus phase are skipped
+        if self._minus_settled and self.step_count == self.quarter_size and self.quarter_num in (1, 2):
+            self.quarter_num += 1
+            self._post_step()
+            return
+
+        # Whole quarter in one fused loop
+        if self.fused:
+            self.cycle_plan().quarter()
+            return
+
         self.step()
         while self.step_count < self.quarter_size:
+            if self._settled(self.step_count):
+                self._end_quarter()
+                return
             self.step()
 
+    # Check for the end of the settling after `steps` steps of the current quarter (or of infer, with its own budget of
+    # max_steps). Must be called after every step, as it tracks the changes of the layers from step to step
+    def _settled(self, steps, max_steps=None):
+        max_steps = self.settle_max_steps if max_steps is None else max_steps
+        change = None if self.settle_tol is None else max(layer.settle_change() for layer in self.layers)
+
+        if max_steps is not None and steps >= max_steps:
+            return True
+        if change is not None and steps >= self.settle_min_steps and change < self.settle_tol:
+            if self.phase == 'minus':
+                self._minus_settled = True
+            return True
+        return False
+
+    # End the current quarter before quarter_size steps. The step counters keep the phase logic consistent
+    def _end_quarter(self):
+        self.step_count = self.quarter_size
+        self._post_step()
+
     # Advance the network one time-step. Called from quarter
     def step(self):
         self._pre_step()
 
-        for conn in self.projections:
-            conn.step()
-        for layer in self.layers:
-            layer.step(self.phase)
+        self._step_all(self.phase)
         self.step_count += 1
         self.total_steps   += 1
+        self.cycle_steps += 1
 
         self._post_step()
 
 
+    # One step of every projection, then of every layer. With several threads, projections transmit concurrently into
+    # their own buffers, all reading the activities of the previous step. Then layers sum their inputs, in the order of
+    # the projection list, and step concurrently: results do not depend on the number of threads
+    def _step_all(self, phase, learning=True):
+        pool = self.thread_pool()
+        if pool is None:
+            for conn in self.projections:
+                conn.step()
+            for layer in self.layers:
+                layer.step(phase, learning)
+            return
+
+        inputs = list(pool.map(lambda conn: conn.transmit(), self.projections))
+
+        def step_layer(i):
+            layer = self.layers[i]
+            for j in self.incoming[i]:
+                layer.net_raw_input += inputs[j]
+            layer.step(phase, learning)
+
+        list(pool.map(step_layer, range(len(self.layers))))
+
+
     ################  Minus/plus phase handlers  ################
 
 
@@ -193,8 +401,7 @@ class Network:
 
         # Store the neuron activity as the medium-term average synaptic activity
         for layer in self.layers:
-            for neuron in layer.neurons:
-                neuron.act_m = neuron.act
+            layer.act_m[:] = layer.act
 
         # Set the current phase to plus
         self.phase = 'plus'
@@ -202,14 +409,22 @@ class Network:
     # Handler for the end of the plus phase (last 25 msec of a cycle)
     def end_plus_phase(self):
 
-        # Projections change their weights based on the formulas for error-driven learning
-        for conn in self.projections:
-            conn.learn()
+        # Batches are for inference only: all patterns share the weights, which are not learned
+        if self.batch_size is None:
+            # Projections change their weights based on the formulas for error-driven learning. Projections with a
+            # weight update interval only accumulate the changes, and update their weights once per interval
+            for conn in self.projections:
+                conn.learn()
 
-        # Update the long-term average synaptic activity, done at the end of every cycle
-        for layer in self.layers:
-            for neuron in layer.neurons:
-                neuron.update_avg_l()
+            # Update the long-term average synaptic activity, done at the end of every cycle
+            for layer in self.layers:
+                layer.update_avg_l()
 
         # Set the current phase to minus
-        self.phase = 'minus'
\ No newline at end of file
+        self.phase = 'minus'
+
+    # Apply the weight changes that projections with a weight update interval have accumulated, e.g. at the end of
+    # training
+    def flush_dwt(self):
+        for conn in self.projections:
+            conn.flush_dwt()
\ No newline at end of file
@@ -1,25 +1,42 @@
 import numpy as np
-import random
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal, sparse
 
+from .topography import receptive_fields, lateral, random_fan_in, conv_output_size
 
-# A synapse is a connection between two neurons
+
+# A synapse is a connection between two neurons. Its weights live in the arrays of the projection
 class Synapse:
-    # Index = position in the weight matrix
 
-    def __init__(self, pre_neuron, post_neuron, w0, fw0, index=None):
+    def __init__(self, projection, pre_neuron, post_neuron, index):
+        # The projection storing the weights
+        self.projection = projection
+
         # TODO: Change to less confusing pre_neuron
         # The sending neuron
         self.pre = pre_neuron
         # The receiving neuron
         self.post = post_neuron
 
-        # Initial weight value
-        self.wt = w0
-        # Initial fast weight value; used for fast/slow learning dynamic
-        self.fwt = fw0
+        # Index = position in the weight arrays of the projection
+        self.index = index
+
+
+# Map a weight variable of the synapse to its element in the projection's array
+def _weight_property(name):
+
+    def getter(self):
+        return getattr(self.projection, name)[self.index]
+
+    def setter(self, value):
+        getattr(self.projection, name)[self.index] = value
 
-        # Change in synaptic weights due to learning
-        self.dwt = 0.0
+    return property(getter, setter)
+
+
+# Weight value, fast weight value (used for fast/slow learning dynamic), and change in weight due to learning
+for _name in ('wt', 'fwt', 'dwt'):
+    setattr(Synapse, _name, _weight_property(_name))
 
 
 # Projection is a connection between two layers
@@ -31,15 +48,45 @@ class Projection:
         self.pre = pre_layer
         # The layer receiving the activity
         self.post = post_layer
-        self.synapses = []
+
+        # Weights, fast weights and weight changes. Arrays of shape (pre size, post size) for full projections,
+        # vectors of the diagonal for 1to1 projections, and vectors of the existing connections for sparse projections
+        self.wt = None
+        self.fwt = None
+        self.dwt = None
+        # Sparse projections: pre-neuron and post-neuron of every connection, sorted by post-neuron
+        self._pre_idx = None
+        self._post_idx = None
+        self._indptr = None
+        # Sparse projections: CSR matrix (post size, pre size) sharing the wt array, created on demand
+        self._wt_matrix = None
+        # Synapse views on the weight arrays, created on demand
+        self._synapses = None
 
         ########### Parameters ###########
 
         # Is this and inhibitory projection? TODO: Inhibitory projections not yet implemented
         self.inhib = True
-        # Connection pattern for projections. 'full' or '1to1', with 1to1 requiring layers be the same size
+        # Connection pattern for projections. 'full' or '1to1', with 1to1 requiring layers be the same size, or one of
+        # the sparse patterns between 2D layers: 'rf' (receptive fields), 'lateral' (neighbourhood within a layer of
+        # the same shape), 'random' (fixed fan-in)
         self.proj = 'full'
 
+        ########### Sparse connection patterns ###########
+
+        # Receptive fields: window size (int, or (height, width)), 'rect' or 'circle' shape, and stride in pre-neurons
+        # between the windows of neighbouring post-neurons. None spreads the windows evenly over the pre-layer
+        self.rf_size = 3
+        self.rf_shape = 'rect'
+        self.rf_stride = None
+        # Lateral: radius of the neighbourhood, whether a neuron connects to itself, and width of the gaussian decay
+        # of the initial weights with distance (None for no decay)
+        self.lat_radius = 2.0
+        self.lat_self = False
+        self.lat_sigma = None
+        # Random: number of pre-neurons connected to each post-neuron
+        self.fan_in = 10
+
         ########### Random weight initialization parameters ###########
 
         # Shape of random weight initialization
@@ -49,6 +96,9 @@ class Projection:
         self.rnd_mean = 0.5
         # Variance (+-range for uniform)
         self.rnd_var = 0.25
+        # Seed of the projection's random generator, for reproducible weights and connection patterns. None for a
+        # different initialization every time
+        self.seed = None
 
         ########### Learning rule parameters ###########
 
@@ -70,6 +120,18 @@ class Projection:
         self.sig_off = 1.0
         self.sig_gain = 6.0
 
+        # Sparse learning: only compute and apply weight changes for the synapses whose short-term synaptic activity
+        # reaches d_thr, as XCAL is 0 for all the others. Synapses left out keep their weights as they are
+        self.sparse_lrn = False
+        # Number of synapses updated by the last learning step
+        self.n_touched = 0
+
+        # Number of cycles over which weight changes accumulate before being applied to the weights (minibatch-style
+        # schedule). 1 applies them every cycle
+        self.wt_update_interval = 1
+        # Number of cycles accumulated in dwt since the weights were last updated
+        self.dwt_count = 0
+
         ########### Net input scaling parameters ###########
 
         # Absolute scaling weight; directly calculated by strength of the connection
@@ -82,6 +144,13 @@ class Projection:
         # Effective relative scaling weight, scaling relative to other projections
         self.wt_scale_rel_eff = None
 
+        for key, value in kwargs.items():
+            assert hasattr(self, key)
+            setattr(self, key, value)
+
+        # Random generator of the projection, independent of the global random state
+        self.rng = np.random.default_rng(self.seed)
+
         # Connect projected synapses
         self.projection_init()
 
@@ -90,10 +159,6 @@ class Projection:
         # Add this projection to the post-layer's list of incoming projections
         post_layer.incoming_projections.append(self)
 
-        for key, value in kwargs.items():
-            assert hasattr(self, key)
-            setattr(self, key, value)
-
 
     ################  Synapse weight handlers  ################
 
@@ -107,55 +172,109 @@ class Projection:
             print('Error: did you correctly run the network.build() method?')
             raise e
 
-    # Return a matrix of the synapse weights
+    # Number of synapses in this projection
+    @property
+    def num_synapses(self):
+        return self.wt.size
+
+    # Is the projection stored as a sparse matrix
+    @property
+    def is_sparse(self):
+        return self._pre_idx is not None
+
+    # Sparse projections: CSR matrix of the weights, one row of incoming weights per post-neuron
+    @property
+    def wt_matrix(self):
+        if self._wt_matrix is None:
+            self._wt_matrix = sparse.csr_matrix((self.wt, self._pre_idx, self._indptr),
+                                                shape=(self.post.size, self.pre.size), copy=False)
+        return self._wt_matrix
+
+    # Synapses of the projection, as views on the weight arrays
+    @property
+    def synapses(self):
+        if self._synapses is None:
+            # For 1to1 projections
+            if self.proj.lower() == '1to1':
+                self._synapses = [Synapse(self, pre_u, post_u, i)
+                                  for i, (pre_u, post_u) in enumerate(zip(self.pre.neurons, self.post.neurons))]
+            # For sparse projections
+            elif self.is_sparse:
+                self._synapses = [Synapse(self, self.pre.neurons[i], self.post.neurons[j], k)
+                                  for k, (i, j) in enumerate(zip(self._pre_idx, self._post_idx))]
+            # For full projections
+            else:
+                self._synapses = [Synapse(self, pre_u, post_u, (i, j))
+                                  for i, pre_u in enumerate(self.pre.neurons)
+                                  for j, post_u in enumerate(self.post.neurons)]
+        return self._synapses
+
+    # Return a matrix of the synapse weights, (pre size, post size). Read-only view on the weights, not a copy: it follows
+    # the weights as they learn
     @property
     def weights(self):
+        wt = self.wt.view()
+        wt.flags.writeable = False
+
         # For 1to1 projections
         if self.proj.lower() == '1to1':
-            return np.array([[synapse.wt for synapse in self.synapses]])
+            return wt[np.newaxis]
+
+        # For sparse projections, a scipy CSC matrix sharing the weights
+        elif self.is_sparse:
+            return sparse.csc_matrix((wt, self._pre_idx, self._indptr), shape=(self.pre.size, self.post.size),
+                                     copy=False)
 
         # For full projections
         else:
-            # Weight matrix
-            W = np.zeros((len(self.pre.neurons), len(self.post.neurons)))
-            # Synapse iterator
-            synapse_it = iter(self.synapses)
-
-            # Add the weights to the weight matrix
-            for i, pre_u in enumerate(self.pre.neurons):
-                for j, post_u in enumerate(self.post.neurons):
-                    W[i, j] = next(synapse_it).wt
-            return W
-
-    # Override the synapse weights if necessary
+            return wt
+
+    # Override the synapse weights if necessary. Sparse projections also accept a (pre size, post size) matrix, of
+    # which only the existing connections are used
     @weights.setter
     def weights(self, value):
-        # For 1to1 projections
-        if self.proj.lower() == '1to1':
-            assert len(value) == len(self.synapses)
-            for wt, synapse in zip(value, self.synapses):
-                synapse.wt = wt
-                # TODO: fwt needs sig_inv?
-                synapse.fwt = self.sig_inv(wt)
+        value = np.asarray(value, dtype=float)
+        if self.is_sparse and value.shape == (self.pre.size, self.post.size):
+            self.set_weights(value)
+            return
+        assert value.size == self.wt.size
+        self.wt[...] = value.reshape(self.wt.shape)
+        # TODO: fwt needs sig_inv?
+        self.fwt[...] = self.sig_inv(self.wt)
+
+    # Override the weights of the synapses from the pre-neurons selected by pre to the post-neurons selected by post
+    # (index, slice, list of indices or boolean mask). value is broadcast to the (selected pre, selected post) block
+    def set_weights(self, value, pre=slice(None), post=slice(None)):
+        value = np.asarray(value, dtype=float)
+
+        # For 1to1 and sparse projections, only the existing connections of the block are set
+        if self.proj.lower() == '1to1' or self.is_sparse:
+            pre_idx, post_idx = self._connections()
+            pre_pos, pre_n = _block_positions(self.pre.size, pre)
+            post_pos, post_n = _block_positions(self.post.size, post)
+            index = np.flatnonzero((pre_pos[pre_idx] >= 0) & (post_pos[post_idx] >= 0))
+            value = np.broadcast_to(value, (pre_n, post_n))[pre_pos[pre_idx[index]], post_pos[post_idx[index]]]
 
         # For full projections
         else:
-            # Synapse iterator
-            synapse_it = iter(self.synapses)
-            assert len(value) * len(value[0]) == len(self.synapses)
-            for i, pre_u in enumerate(self.pre.neurons):
-                for j, post_u in enumerate(self.post.neurons):
-                    synapse = next(synapse_it)
-                    synapse.wt = value[i][j]
-                    synapse.fwt = self.sig_inv(value[i][j])
-
-    # Randomly initialize weights, according to specified distribution
-    def _rnd_wt(self):
+            index = _block_index(pre, post)
+
+        self.wt[index] = value
+        self.fwt[index] = self.sig_inv(self.wt[index])
+
+    # Pre-neuron and post-neuron of every element of the weight arrays, for 1to1 and sparse projections
+    def _connections(self):
+        if self.is_sparse:
+            return self._pre_idx, self._post_idx
+        return np.arange(self.pre.size), np.arange(self.post.size)
+
+    # Randomly initialize an array of weights of the given shape, according to specified distribution
+    def _rnd_wt(self, shape):
         # TODO: Gaussian or uniform?
         if self.rnd_type == 'uniform':
-            return random.uniform(self.rnd_mean - self.rnd_var, self.rnd_mean + self.rnd_var)
+            return self.rng.uniform(self.rnd_mean - self.rnd_var, self.rnd_mean + self.rnd_var, shape)
         elif self.rnd_type == 'gaussian':
-            return random.gauss(self.rnd_mean, np.sqrt(self.rnd_var))
+            return self.rng.normal(self.rnd_mean, np.sqrt(self.rnd_var), shape)
         raise NotImplementedError
 
 
@@ -164,15 +283,20 @@ class Projection:
 
     # Advance the projection one time-step
     def step(self):
-        # Transmit activity
-        for synapse in self.synapses:
-            # If activity is not forced
-            if synapse.post.act_ext is None:
-                # Scale the activity of the projection
-                scaled_act = self.wt_scale_abs * self.wt_scale * synapse.wt * synapse.pre.act
+        # Transmit activity, added to the post layer's excitatory inputs. Neurons with forced activity ignore it
+        self.post.net_raw_input += self.transmit()
 
-                # Add the scaled activity to the post neuron's list of excitatory inputs
-                synapse.post.add_excitatory(scaled_act)
+    # Activity transmitted to the post-layer in this time-step. Only reads the pre-layer activities, so projections can
+    # transmit concurrently
+    def transmit(self):
+        # Scale the activity of the projection
+        scale = self.wt_scale_abs * self.wt_scale
+
+        if self.proj.lower() == '1to1':
+            return scale * (self.wt * self.pre.act)
+        elif self.is_sparse:
+            return scale * (self.wt_matrix @ self.pre.act.T).T
+        return scale * (self.pre.act @ self.wt)
 
 
     ################  Net input scaling for projections  ################
@@ -184,9 +308,9 @@ class Projection:
         # Pre-layer average activity
         pre_avg_act = self.pre.avg_act_p_eff
         # Pre-layer size
-        pre_size = len(self.pre.neurons)
-        # Number of synapses in this projection
-        num_synapses = len(self.synapses)
+        pre_size = self.pre.size
+        # Average number of synapses received by a post-neuron
+        num_synapses = self.num_synapses / self.post.size
 
         # Constant
         sem_extra = 2.0
@@ -194,10 +318,10 @@ class Projection:
         pre_act_n = max(1, int(pre_avg_act * pre_size + 0.5))
 
         # If it was 1to1
-        if num_synapses == pre_size:
+        if self.proj.lower() == '1to1':
             self.wt_scale_act = 1.0 / pre_act_n
 
-        # If it was full projection
+        # If it was full or sparse projection
         else:
             post_act_n_max = min(num_synapses, pre_act_n)
             post_act_n_avg = max(1, pre_avg_act * num_synapses + 0.5)
@@ -210,31 +334,55 @@ class Projection:
 
     # Connect projected synapses
     def projection_init(self):
+        self._synapses = None
+        self._pre_idx = self._post_idx = self._indptr = self._wt_matrix = None
         if self.proj == 'full':
             self._full_projection()
-        if self.proj == '1to1':
+        elif self.proj == '1to1':
             self._1to1_projection()
+        elif self.proj == 'rf':
+            self._sparse_projection(*receptive_fields(self.pre.grid_shape, self.post.grid_shape, self.rf_size,
+                                                      self.rf_stride, self.rf_shape))
+        elif self.proj == 'lateral':
+            self._lateral_projection()
+        elif self.proj == 'random':
+            self._sparse_projection(*random_fan_in(self.pre.size, self.post.size, self.fan_in, self.rng))
+        else:
+            raise NotImplementedError(self.proj)
 
     # Fully project the pre-neurons to the post-neurons
     def _full_projection(self):
-        # Store the neuron to neuron synapses
-        self.synapses = []
-        for i, pre_u in enumerate(self.pre.neurons):
-            for j, post_u in enumerate(self.post.neurons):
-                w0 = self._rnd_wt()
-                fw0 = self.sig_inv(w0)
-                self.synapses.append(Synapse(pre_u, post_u, w0, fw0, index=(i, j)))
-
-    # Project one pre-neuron to one post-neuron for every neuron in the layers
+        self._init_weights((self.pre.size, self.post.size))
+
+    # Project one pre-neuron to one post-neuron for every neuron in the layers. Only the diagonal is stored
     def _1to1_projection(self):
-        # Store the neuron to neuron synapses
-        self.synapses = []
         # 1to1 MUST have same layer size
-        assert len(self.pre.neurons) == len(self.post.neurons)
-        for i, (pre_u, post_u) in enumerate(zip(self.pre.neurons, self.post.neurons)):
-            w0 = self._rnd_wt()
-            fw0 = self.sig_inv(w0)
-            self.synapses.append(Synapse(pre_u, post_u, w0, fw0, index=(i, i)))
+        assert self.pre.size == self.post.size
+        self._init_weights((self.pre.size,))
+
+    # Connect each post-neuron to the pre-neurons within lat_radius of its position, with initial weights decaying with
+    # distance if lat_sigma is set
+    def _lateral_projection(self):
+        # Lateral MUST have same layer shape
+        assert self.pre.grid_shape == self.post.grid_shape
+        pre_idx, post_idx, dist = lateral(self.post.grid_shape, self.lat_radius, self.lat_self)
+        gain = 1.0 if self.lat_sigma is None else np.exp(-dist ** 2 / (2 * self.lat_sigma ** 2))
+        self._sparse_projection(pre_idx, post_idx, gain)
+
+    # Only connect the given (pre-neuron, post-neuron) pairs. The connections are stored sorted by post-neuron, as the
+    # rows of a CSR matrix. gain scales the initial weights, per connection
+    def _sparse_projection(self, pre_idx, post_idx, gain=1.0):
+        order = np.lexsort((pre_idx, post_idx))
+        self._pre_idx = np.asarray(pre_idx)[order]
+        self._post_idx = np.asarray(post_idx)[order]
+        self._indptr = np.concatenate(([0], np.cumsum(np.bincount(self._post_idx, minlength=self.post.size))))
+        self._init_weights(self._pre_idx.shape, np.broadcast_to(gain, order.shape)[order])
+
+    # Allocate the weight arrays with the given shape, and randomly initialize the weights, scaled by gain
+    def _init_weights(self, shape, gain=1.0):
+        self.wt = self._rnd_wt(shape) * gain
+        self.fwt = self.sig_inv(self.wt)
+        self.dwt = np.zeros(shape)
 
 
     ################  Learning  ################
@@ -243,66 +391,304 @@ class Projection:
     # Execute "learning"
     def learn(self):
 
+        # Synapses to update: all of them, or only the active ones for sparse learning
+        active = self._active_synapses() if self.sparse_lrn else None
+        index = Ellipsis if active is None else active[0]
+        self.n_touched = self.num_synapses if active is None else np.broadcast(active[1], active[2]).size
+
         # TODO: Needed? Probably, to turn learning off
         if self.lrule is not None:
             # Calculate synaptic weight change
-            self.learning_rule()
+            self.learning_rule(active)
 
-            # Apply synaptic weight change
-            self.apply_dwt()
+            # Accumulate the weight changes until the end of the update interval
+            self.dwt_count += 1
+            if self.dwt_count < self.wt_update_interval:
+                return
+
+            # Apply synaptic weight change. Sparse learning over several cycles changed more than the synapses active
+            # in this one
+            if active is not None and self.wt_update_interval > 1:
+                index = np.nonzero(self.dwt)
+            self.apply_dwt(index)
 
         # Clip the weights to between 0.0-1.0 after weight change
         # TODO: Needed? Or should be done automatically?
-        for synapse in self.synapses:
-            synapse.wt = max(0.0, min(1.0, synapse.wt))
-
-    # The NEXUS learning rule. Calculates synaptic weight change
-    def learning_rule(self):
-        for i, synapse in enumerate(self.synapses):
-            # Calculate effective short-term average synaptic activity
-            srs = synapse.post.avg_s_eff * synapse.pre.avg_s_eff
-            # Calculate medium-term average synaptic activity
-            srm = synapse.post.avg_m * synapse.pre.avg_m
-
-            # Calculate the change in synaptic weight using the learning function
-            synapse.dwt += (self.lrate * (self.m_lrn * self.xcal(srs, srm)
-                                       + synapse.post.avg_l_lrn * self.xcal(srs, synapse.post.avg_l)))
-
-    # Apply the change in weighs resulting from learning
-    def apply_dwt(self):
-
-        for synapse in self.synapses:
-            synapse.dwt *= (1 - synapse.fwt) if (synapse.dwt > 0) else synapse.fwt
-            synapse.fwt += synapse.dwt
-            synapse.wt = self.sig(synapse.fwt)
-
-            synapse.dwt = 0.0
+        if index is Ellipsis:
+            np.clip(self.wt, 0.0, 1.0, out=self.wt)
+        else:
+            self.wt[index] = np.clip(self.wt[index], 0.0, 1.0)
+
+    # Apply the weight changes accumulated since the last update, without waiting for the end of the update interval
+    # (e.g. at the end of training)
+    def flush_dwt(self):
+        if self.dwt_count > 0:
+            index = np.nonzero(self.dwt) if self.sparse_lrn else Ellipsis
+            self.apply_dwt(index)
+            self.wt[index] = np.clip(self.wt[index], 0.0, 1.0)
+
+    # The NEXUS learning rule. Calculates synaptic weight change for all synapses at once, or only for the active
+    # synapses given by _active_synapses
+    def learning_rule(self, active=None):
+        index = Ellipsis if active is None else active[0]
+
+        # Calculate effective short-term average synaptic activity
+        srs = self._synaptic(self.pre.avg_s_eff, self.post.avg_s_eff, active)
+        # Calculate medium-term average synaptic activity
+        srm = self._synaptic(self.pre.avg_m, self.post.avg_m, active)
+
+        # Long-term average activity of the post-neurons, and its weighting for self-organized learning
+        avg_l = self._post_values(self.post.avg_l, active)
+        avg_l_lrn = self._post_values(self.post.avg_l_lrn, active)
+
+        # Calculate the change in synaptic weight using the learning function. Post-layer values broadcast over the
+        # pre-layer axis
+        self.dwt[index] += self.lrate * (self.m_lrn * self.xcal(srs, srm) + avg_l_lrn * self.xcal(srs, avg_l))
+
+    # Apply the change in weighs resulting from learning, to all synapses or to the synapses selected by index
+    def apply_dwt(self, index=Ellipsis):
+        dwt, fwt = self.dwt[index], self.fwt[index]
+
+        # Soft-bounding: increases are scaled by the distance to 1, decreases by the distance to 0
+        dwt *= np.where(dwt > 0, 1 - fwt, fwt)
+        fwt += dwt
+        self.fwt[index] = fwt
+        self.wt[index] = self.sig(fwt)
+
+        self.dwt[index] = 0.0
+        self.dwt_count = 0
+
+    # Synapses that can learn: the ones whose pre-neuron and post-neuron short-term averages have a product of at least
+    # d_thr. Returns the index of the synapses in the weight arrays, and the indices of their pre-neurons and
+    # post-neurons, shaped like the selected weights
+    def _active_synapses(self):
+        pre_s, post_s = self.pre.avg_s_eff, self.post.avg_s_eff
+
+        # For 1to1 and sparse projections, check every connection
+        if self.proj.lower() == '1to1' or self.is_sparse:
+            pre_idx, post_idx = self._connections()
+            index = np.flatnonzero(pre_s[pre_idx] * post_s[post_idx] >= self.d_thr)
+            return index, pre_idx[index], post_idx[index]
+
+        # For full projections, the submatrix of the pre-neurons and post-neurons that reach d_thr with the most
+        # active neuron of the other layer
+        pre_active = np.flatnonzero(pre_s * post_s.max() >= self.d_thr)
+        post_active = np.flatnonzero(post_s * pre_s.max() >= self.d_thr)
+        return np.ix_(pre_active, post_active), pre_active[:, np.newaxis], post_active
+
+    # Product of pre-layer and post-layer values for every synapse of the projection, or for the active synapses
+    def _synaptic(self, pre_values, post_values, active=None):
+        if active is not None:
+            return pre_values[active[1]] * post_values[active[2]]
+        elif self.proj.lower() == '1to1':
+            return pre_values * post_values
+        elif self.is_sparse:
+            return pre_values[self._pre_idx] * post_values[self._post_idx]
+        return np.outer(pre_values, post_values)
+
+    # Post-layer values aligned with the weight arrays: one value per connection for sparse projections or active
+    # synapses, otherwise the values broadcast as they are
+    def _post_values(self, post_values, active=None):
+        if active is not None:
+            return post_values[active[2]]
+        elif self.is_sparse:
+            return post_values[self._post_idx]
+        return post_values
+
+    # The CSR matrix shares the wt array: it is not copied or pickled, but created again when first needed
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_wt_matrix'] = None
+        return state
 
 
     ################  Function calculations  ################
 
 
-    # XCAL learning function
+    # XCAL learning function, of values or arrays of values
     def xcal(self, x, th):
-        if x < self.d_thr:
-            return 0
-        elif x > th * self.d_rev:
-            return x - th
-        else:
-            return -x * ((1 - self.d_rev)/self.d_rev)
+        return np.where(x < self.d_thr, 0.0,
+                        np.where(x > th * self.d_rev, x - th, -x * ((1 - self.d_rev) / self.d_rev)))
 
     # TODO: Sigmoid activation function (need?)
     def sig(self, w):
-        return 1 / (1 + (self.sig_off * (1 - w) / w) ** self.sig_gain)
+        # A weight of 0 gives (1 - w) / w = inf, and a sigmoid of 0
+        with np.errstate(divide='ignore'):
+            return 1 / (1 + (self.sig_off * (1 - w) / w) ** self.sig_gain)
 
-    # TODO: Inverse sigmoid (need?)
+    # TODO: Inverse sigmoid (need?) Of values or arrays of values
     def sig_inv(self, w):
+        w = np.asarray(w, dtype=float)
+
+        # Inverse sigmoid, in the open range only
+        inside = (w > 0.0) & (w < 1.0)
+        w_in = np.where(inside, w, 0.5)
+        inv = 1 / (1 + ((1 - w_in) / w_in) ** (1 / self.sig_gain) / self.sig_off)
 
         # Clamp range
-        if w <= 0.0:
-            return 0.0
-        elif w >= 1.0:
-            return 1.0
+        return np.where(inside, inv, np.clip(w, 0.0, 1.0))[()]
+
+# Index of the block of a 2D array selected by first and second (indices, slices, lists of indices or boolean masks)
+def _block_index(first, second):
+    if np.ndim(first) == 1 and np.ndim(second) == 1:
+        return np.ix_(*(np.flatnonzero(i) if np.asarray(i).dtype == bool else i for i in (first, second)))
+    return first, second
+
+
+# Position in the block of every element selected by index among size elements (-1 for the ones not selected), and
+# number of elements selected
+def _block_positions(size, index):
+    selected = np.atleast_1d(np.arange(size)[index])
+    positions = np.full(size, -1)
+    positions[selected] = np.arange(len(selected))
+    return positions, len(selected)
+
+
+# Convolutional projection: a bank of kernels shared by all the positions of the pre-layer. The pre-layer and post-layer
+# are stacks of feature maps (see Layer.geometry): every post-layer map is the correlation of the pre-layer maps with one
+# kernel, so the post-layer geometry must be (number of kernels, output rows, output cols)
+class ConvProjection(Projection):
+
+    def __init__(self, pre_layer, post_layer, **kwargs):
+
+        ########### Convolution parameters ###########
+
+        # Size of the kernels (int, or (height, width))
+        self.kernel_size = 3
+        # Distance in pre-neurons between neighbouring positions of the kernels
+        self.conv_stride = 1
+        # Zero padding added around the pre-layer maps
+        self.conv_pad = 0
+        # Kernels at least this big (in both directions) are applied with FFTs instead of directly
+        self.fft_min_size = 8
+
+        super().__init__(pre_layer, post_layer, proj='conv', **kwargs)
+
+
+    ################  Synapse weight handlers  ################
+
+
+    # Shape (kernels, pre-layer maps, height, width) of the weight arrays
+    @property
+    def kernel_shape(self):
+        kh, kw = (self.kernel_size, self.kernel_size) if np.isscalar(self.kernel_size) else self.kernel_size
+        return self.post.map_shape[0], self.pre.map_shape[0], kh, kw
+
+    # Override the kernels of the post-layer maps selected by post, on the pre-layer maps selected by pre. value is
+    # broadcast to the (selected kernels, selected maps, height, width) block
+    def set_weights(self, value, pre=slice(None), post=slice(None)):
+        index = _block_index(post, pre)
+        self.wt[index] = value
+        self.fwt[index] = self.sig_inv(self.wt[index])
+
+    # Number of synapses in this projection, i.e. connections between neurons, not distinct weights
+    @property
+    def num_synapses(self):
+        return self.post.size * int(np.prod(self.kernel_shape[1:]))
+
+    # Synapses of the projection. Synapses at different positions are views on the same kernel weight
+    @property
+    def synapses(self):
+        if self._synapses is None:
+            n_kernels, n_maps, kh, kw = self.kernel_shape
+            _, rows, cols = self.pre.map_shape
+            _, out_rows, out_cols = self.post.map_shape
+            self._synapses = []
+            for post_i, (k, y, x) in enumerate(np.ndindex(n_kernels, out_rows, out_cols)):
+                for c, i, j in np.ndindex(n_maps, kh, kw):
+                    pre_y = y * self.conv_stride + i - self.conv_pad
+                    pre_x = x * self.conv_stride + j - self.conv_pad
+                    if 0 <= pre_y < rows and 0 <= pre_x < cols:
+                        pre_i = (c * rows + pre_y) * cols + pre_x
+                        self._synapses.append(Synapse(self, self.pre.neurons[pre_i], self.post.neurons[post_i],
+                                                      (k, c, i, j)))
+        return self._synapses
+
+
+    ################  Time-step handler  ################
+
+
+    # Activity transmitted to the post-layer in this time-step
+    def transmit(self):
+        # Scale the activity of the projection
+        scale = self.wt_scale_abs * self.wt_scale
+
+        return scale * self.correlate(self.pre.act)
+
+    # Correlation of pre-layer values with the kernels, flattened to post-layer values. Works on a batch of patterns
+    def correlate(self, pre_values):
+        _, _, kh, kw = self.kernel_shape
+        maps = self._pad(pre_values)
+
+        # Large kernels: FFT correlation of every (kernel, map) pair at stride 1, summed over the maps
+        if kh >= self.fft_min_size and kw >= self.fft_min_size:
+            kernels = self.wt[..., ::-1, ::-1].reshape((1,) * (maps.ndim - 3) + self.wt.shape)
+            out = signal.fftconvolve(maps[..., np.newaxis, :, :, :], kernels, mode='valid', axes=(-2, -1))
+            out = out.sum(axis=-3)[..., ::self.conv_stride, ::self.conv_stride]
+
+        # Small kernels: product of the patches under each position with the kernels
+        else:
+            out = np.einsum('...chwij,kcij->...khw', self._patches(maps), self.wt, optimize=True)
+
+        return out.reshape(out.shape[:-3] + (self.post.size,))
+
+    # Pre-layer values as zero-padded maps, of shape (..., maps, rows, cols)
+    def _pad(self, pre_values):
+        maps = pre_values.reshape(pre_values.shape[:-1] + self.pre.map_shape)
+        if self.conv_pad:
+            pad = self.conv_pad
+            maps = np.pad(maps, [(0, 0)] * (maps.ndim - 2) + [(pad, pad), (pad, pad)])
+        return maps
+
+    # Patches of padded maps under every position of the kernels, of shape (..., maps, out rows, out cols, kh, kw)
+    def _patches(self, maps):
+        _, _, kh, kw = self.kernel_shape
+        patches = sliding_window_view(maps, (kh, kw), axis=(-2, -1))
+        return patches[..., ::self.conv_stride, ::self.conv_stride, :, :]
+
+
+    ################  Initialize projections  ################
+
+
+    # Allocate and randomly initialize the kernels
+    def projection_init(self):
+        self._synapses = None
+        n_kernels, n_maps, kh, kw = self.kernel_shape
+        _, rows, cols = self.pre.map_shape
+
+        # Every kernel is shared by all positions: there is no subset of synapses to learn alone
+        assert not self.sparse_lrn
+
+        # The post-layer must hold one map per kernel, of the size of the output of the convolution
+        assert self.post.map_shape == (n_kernels, conv_output_size(rows, kh, self.conv_stride, self.conv_pad),
+                                       conv_output_size(cols, kw, self.conv_stride, self.conv_pad))
+
+        self._init_weights(self.kernel_shape)
+
+
+    ################  Learning  ################
+
 
-        # Return inverse sigmoid
-        return 1 / (1 + ((1 - w) / w) ** (1 / self.sig_gain) / self.sig_off)
\ No newline at end of file
+    # The NEXUS learning rule, computed for every connection and averaged over the positions sharing each kernel. Sparse
+    # learning does not apply to shared kernels
+    def learning_rule(self, active=None):
+        # Patches of the pre-layer averages under every position, of shape (maps, out rows, out cols, kh, kw)
+        pre_s = self._patches(self._pad(self.pre.avg_s_eff))
+        pre_m = self._patches(self._pad(self.pre.avg_m))
+
+        # Post-layer values, per kernel and position
+        post_shape = self.post.map_shape
+        post_s = self.post.avg_s_eff.reshape(post_shape)[:, :, :, np.newaxis, np.newaxis]
+        post_m = self.post.avg_m.reshape(post_shape)[:, :, :, np.newaxis, np.newaxis]
+        avg_l = self.post.avg_l.reshape(post_shape)[:, :, :, np.newaxis, np.newaxis]
+        avg_l_lrn = np.reshape(self.post.avg_l_lrn, post_shape)[:, :, :, np.newaxis, np.newaxis]
+
+        # One kernel at a time, to bound the size of the per-connection arrays
+        for k in range(self.wt.shape[0]):
+            # Calculate effective short-term and medium-term average synaptic activity
+            srs = pre_s * post_s[k]
+            srm = pre_m * post_m[k]
+
+            # Change in synaptic weight of every connection, averaged over the positions
+            dwt = self.m_lrn * self.xcal(srs, srm) + avg_l_lrn[k] * self.xcal(srs, avg_l[k])
+            self.dwt[k] += self.lrate * dwt.mean(axis=(1, 2))
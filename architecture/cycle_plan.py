@@ -0,0 +1,332 @@
+"""
+
+Fused execution of quarters and cycles
+
+"""
+
+import numpy as np
+
+from .neuron import nxx1_table
+
+
+# Parameters of the neurons that the layer kernels bind when they are compiled
+_unit_params = ('integ_dt', 'net_input_dt', 'v_m_dt', 'g_bar_e', 'g_bar_i', 'g_bar_l', 'g_l', 'e_e', 'e_i', 'e_l',
+                'act_thr', 'v_m_r', 'adapt_on', 'adapt_dt', 'v_m_gain', 'spike_gain', 'avg_ss_dt', 'avg_s_dt',
+                'avg_m_dt', 'avg_m_in_s', 'act_gain', 'act_sd', 'nxx1_res')
+
+# State arrays of the layers and projections that the kernels are closures over
+_layer_arrays = ('g_e', 'I_net', 'I_net_r', 'v_m', 'v_m_eq', 'act', 'act_nd', 'adapt_curr', 'did_spike', 'avg_ss',
+                 'avg_s', 'avg_m', 'avg_s_eff', 'net_raw_input', 'clamped', 'logs')
+_projection_arrays = ('wt', 'pre', 'post')
+
+
+# What the kernels of a network are compiled from: its layers and projections, the parameters bound by the kernels, and
+# the state arrays they work on. The plan is compiled again whenever it changes
+def _binding(network):
+    return ([(l, tuple(getattr(l.unit, name) for name in _unit_params),
+              tuple(id(getattr(l, name)) for name in _layer_arrays)) for l in network.layers],
+            [(p, p.proj, tuple(id(getattr(p, name)) for name in _projection_arrays)) for p in network.projections])
+
+
+# Execution plan of a network. Runs all the steps of a quarter in one tight loop, with the parameters of every layer and
+# projection bound once, and scratch arrays preallocated. The plan follows the network: it is compiled again when
+# layers or projections are added, parameters of the neurons change or state arrays are reallocated
+class CyclePlan:
+
+    def __init__(self, network):
+        self.network = network
+        self.binding = None
+        self.transmit_kernels = self.layer_kernels = None
+        self.update()
+
+    # Compile the kernels if the network has changed since they were compiled
+    def update(self):
+        if self.layer_kernels is None or self.binding != _binding(self.network):
+            self.compile()
+
+    # Compile the kernels, one per projection and per layer
+    def compile(self):
+        network = self.network
+        self.binding = _binding(network)
+
+        # Execution order: all projections transmit, then all layers advance
+        self.projections = list(network.projections)
+        self.layers = list(network.layers)
+        self.transmit_kernels = [_projection_kernel(p) for p in self.projections]
+        self.layer_kernels = [_layer_kernel(l) for l in self.layers]
+
+    # Kernels are closures over the state arrays: they are not copied or pickled, but compiled again when first needed
+    def __getstate__(self):
+        return {'network': self.network, 'binding': None, 'transmit_kernels': None, 'layer_kernels': None}
+
+    # Run the remainder of the current quarter. Quarter, phase and clamp handling happen once at the start and end of
+    # the quarter, in Network._pre_step and Network._post_step
+    def quarter(self):
+        network = self.network
+
+        # Start of the quarter: new cycle, clamps of the inputs/outputs, net input scaling
+        network._pre_step()
+
+        # Steps of the quarter, possibly ending early when the network settles
+        step_count = network.step_count
+        settled = None
+        if network.settle_tol is not None or network.settle_max_steps is not None:
+            def settled(steps):
+                return steps < network.quarter_size - step_count and network._settled(step_count + steps)
+        n_steps = self.run(network.quarter_size - step_count, minus=network.phase == 'minus', settled=settled)
+
+        # Step counters, as if the quarter had been run step by step
+        network.step_count += n_steps
+        network.total_steps += n_steps
+        network.cycle_steps += n_steps
+        if network.step_count < network.quarter_size:
+            network._end_quarter()
+            return
+
+        # End of the quarter: minus/plus phase handlers
+        network._post_step()
+
+
+    # Run n_steps steps of the network in one loop. The phase, and whether the averages for learning are updated, are
+    # constant over the steps. settled(steps) is called after every step, and ends the loop early when it returns True.
+    # Return the number of steps executed
+    def run(self, n_steps, minus=True, learning=True, settled=None):
+        self.update()
+
+        # Everything below is constant over the steps
+        transmits = [(kernel, p.wt_scale_abs * p.wt_scale, p.post.net_raw_input)
+                     for kernel, p in zip(self.transmit_kernels, self.projections)]
+        layer_kernels = self.layer_kernels
+        pool = self.network.thread_pool()
+
+        # With threads: projections transmit concurrently, then layers sum their inputs in order and step concurrently
+        if pool is not None:
+            incoming = self.network.incoming
+
+            def transmit_one(t):
+                return t[0](t[1])
+
+            def step_layer(i):
+                for j in incoming[i]:
+                    net_raw_input = transmits[j][2]
+                    np.add(net_raw_input, inputs[j], out=net_raw_input)
+                layer_kernels[i](minus, learning)
+
+        steps = 0
+        while steps < n_steps:
+            if pool is None:
+                for transmit, scale, net_raw_input in transmits:
+                    np.add(net_raw_input, transmit(scale), out=net_raw_input)
+                for kernel in layer_kernels:
+                    kernel(minus, learning)
+            else:
+                inputs = list(pool.map(transmit_one, transmits))
+                list(pool.map(step_layer, range(len(layer_kernels))))
+            steps += 1
+            if settled is not None and settled(steps):
+                break
+
+        for layer in self.layers:
+            layer.step_count += steps
+        return steps
+
+
+################  Kernels  ################
+
+
+# Fused version of Projection.transmit: returns the transmitted activity, in a preallocated buffer
+def _projection_kernel(projection):
+    one_to_one = projection.proj.lower() == '1to1'
+    conv = projection.proj == 'conv'
+    wt = projection.wt
+    wt_matrix = projection.wt_matrix if projection.is_sparse else None
+    pre_act = projection.pre.act
+    net_raw_input = projection.post.net_raw_input
+
+    scaled_act = np.empty(net_raw_input.shape)
+
+    def transmit(scale):
+        if one_to_one:
+            np.multiply(wt, pre_act, out=scaled_act)
+        elif wt_matrix is not None:
+            scaled_act[...] = (wt_matrix @ pre_act.T).T
+        elif conv:
+            scaled_act[...] = projection.correlate(pre_act)
+        else:
+            np.matmul(pre_act, wt, out=scaled_act)
+        np.multiply(scaled_act, scale, out=scaled_act)
+        return scaled_act
+
+    return transmit
+
+
+# Fused version of Layer.step. Same operations, in the same order, on preallocated arrays
+def _layer_kernel(layer):
+    u = layer.unit
+
+    ########### Constants ###########
+
+    net_dt = u.integ_dt * u.net_input_dt
+    v_m_dt = u.integ_dt * u.v_m_dt
+    half_v_m_dt = u.integ_dt / 2 * u.v_m_dt
+    g_bar_e, g_bar_i = u.g_bar_e, u.g_bar_i
+    gc_l = u.g_bar_l * u.g_l
+    e_e, e_i, e_l = u.e_e, u.e_i, u.e_l
+    act_thr, v_m_r = u.act_thr, u.v_m_r
+    thr_e_e = act_thr - u.e_e
+    gc_l_thr = gc_l * (e_l - act_thr)
+    adapt_on = u.adapt_on
+    adapt_dt, v_m_gain, spike_gain, integ_dt = u.adapt_dt, u.v_m_gain, u.spike_gain, u.integ_dt
+    avg_ss_dt = u.integ_dt * u.avg_ss_dt
+    avg_s_dt = u.integ_dt * u.avg_s_dt
+    avg_m_dt = u.integ_dt * u.avg_m_dt
+    avg_m_in_s = u.avg_m_in_s
+
+    # Noisy xx1 look-up table
+    act_gain = u.act_gain
+    xs, conv = nxx1_table(u.act_gain, u.act_sd, u.nxx1_res)
+    xs_min, xs_max = xs[0], xs[-1]
+
+    ########### State arrays ###########
+
+    g_e, I_net, I_net_r = layer.g_e, layer.I_net, layer.I_net_r
+    v_m, v_m_eq = layer.v_m, layer.v_m_eq
+    act, act_nd, adapt_curr, did_spike = layer.act, layer.act_nd, layer.adapt_curr, layer.did_spike
+    avg_ss, avg_s, avg_m, avg_s_eff = layer.avg_ss, layer.avg_s, layer.avg_m, layer.avg_s_eff
+    net_raw_input, clamped = layer.net_raw_input, layer.clamped
+    logs, update_logs = layer.logs, layer.update_logs
+    layer_mean = layer._mean
+
+    ########### Scratch arrays ###########
+
+    free = np.empty(clamped.shape, dtype=bool)
+    spike = np.empty(clamped.shape, dtype=bool)
+    mask = np.empty(clamped.shape, dtype=bool)
+    gc_e, new, t1, t2, v_eff = (np.empty(g_e.shape) for _ in range(5))
+    new_v_m, new_v_m_eq, new_I_net, new_I_net_r, new_act = (np.empty(g_e.shape) for _ in range(5))
+
+    # Net current for membrane potentials v_m_eff, integrated in the given number of steps, into out
+    def net_current(v_m_0, steps, dt, out):
+        np.copyto(v_eff, v_m_0)
+        for _ in range(steps):
+            np.subtract(e_e, v_eff, out=out)
+            np.multiply(out, gc_e, out=out)
+            np.subtract(e_i, v_eff, out=t1)
+            np.multiply(t1, gc_i, out=t1)
+            np.add(out, t1, out=out)
+            np.subtract(e_l, v_eff, out=t1)
+            np.multiply(t1, gc_l, out=t1)
+            np.add(out, t1, out=out)
+            np.subtract(out, adapt_curr, out=out)
+            np.multiply(dt, out, out=t1)
+            np.add(v_eff, t1, out=v_eff)
+
+    def kernel(minus, learning):
+        nonlocal gc_i
+
+        # Fully clamped layer, see Layer.freeze
+        if layer.frozen:
+            net_raw_input[...] = 0.0
+            if learning:
+                layer.frozen_steps += 1
+            return
+
+        np.logical_not(clamped, out=free)
+
+        # Net input
+        np.subtract(net_raw_input, g_e, out=t1)
+        np.multiply(t1, net_dt, out=t1)
+        np.add(t1, g_e, out=t1)
+        np.copyto(g_e, t1, where=free)
+        net_raw_input[...] = 0.0
+
+        # Inhibition
+        if minus:
+            layer.gc_i = layer.inhibition()
+        gc_i = g_bar_i * layer.gc_i
+
+        # Net currents
+        np.multiply(g_bar_e, g_e, out=gc_e)
+        net_current(v_m, 2, half_v_m_dt, new_I_net)
+        net_current(v_m_eq, 1, v_m_dt, new_I_net_r)
+
+        # Membrane potentials
+        np.multiply(v_m_dt, new_I_net, out=new_v_m)
+        np.add(new_v_m, v_m, out=new_v_m)
+        np.multiply(v_m_dt, new_I_net_r, out=new_v_m_eq)
+        np.add(new_v_m_eq, v_m_eq, out=new_v_m_eq)
+
+        # Spikes
+        np.greater(new_v_m, act_thr, out=spike)
+        np.copyto(new_v_m, v_m_r, where=spike)
+        np.copyto(new_I_net, 0.0, where=spike)
+
+        # Argument of the activation function: v_m_eq below threshold, g_e - g_e_thr above
+        np.subtract(gc_i * (e_i - act_thr) + gc_l_thr, adapt_curr, out=t2)
+        np.divide(t2, thr_e_e, out=t2)
+        np.subtract(gc_e, t2, out=t2)
+        np.less_equal(new_v_m_eq, act_thr, out=mask)
+        np.subtract(new_v_m_eq, act_thr, out=t2, where=mask)
+
+        # Noisy xx1
+        new_act[...] = np.interp(t2, xs, conv)
+        np.less(t2, xs_min, out=mask)
+        np.copyto(new_act, 0.0, where=mask)
+        np.greater(t2, xs_max, out=mask)
+        if mask.any():
+            np.maximum(t2, 0.0, out=t1)
+            np.multiply(t1, act_gain, out=t1)
+            np.add(t1, 1, out=new)
+            np.divide(t1, new, out=t1)
+            np.copyto(new_act, t1, where=mask)
+
+        # Activity
+        np.subtract(new_act, act_nd, out=new_act)
+        np.multiply(new_act, v_m_dt, out=new_act)
+        np.add(new_act, act_nd, out=new_act)
+
+        # Adaptation
+        if adapt_on:
+            np.subtract(new_v_m, e_l, out=t1)
+            np.multiply(t1, v_m_gain, out=t1)
+            np.subtract(t1, adapt_curr, out=t1)
+            np.multiply(t1, adapt_dt, out=t1)
+            np.multiply(spike, spike_gain, out=t2)
+            np.add(t1, t2, out=t1)
+            np.multiply(t1, integ_dt, out=t1)
+            np.add(t1, adapt_curr, out=t1)
+            np.copyto(adapt_curr, t1, where=free)
+
+        np.copyto(I_net, new_I_net, where=free)
+        np.copyto(I_net_r, new_I_net_r, where=free)
+        np.copyto(v_m, new_v_m, where=free)
+        np.copyto(v_m_eq, new_v_m_eq, where=free)
+        np.copyto(did_spike, spike, where=free)
+        np.copyto(act_nd, new_act, where=free)
+        np.copyto(act, new_act, where=free)
+
+        # Averages for learning
+        if learning:
+            update_avgs()
+
+        layer.avg_act = layer_mean(act)
+        if logs:
+            update_logs()
+
+    # Fused version of Layer.update_avgs
+    def update_avgs():
+        np.subtract(act_nd, avg_ss, out=t1)
+        np.multiply(t1, avg_ss_dt, out=t1)
+        np.add(avg_ss, t1, out=avg_ss)
+        np.subtract(avg_ss, avg_s, out=t1)
+        np.multiply(t1, avg_s_dt, out=t1)
+        np.add(avg_s, t1, out=avg_s)
+        np.subtract(avg_s, avg_m, out=t1)
+        np.multiply(t1, avg_m_dt, out=t1)
+        np.add(avg_m, t1, out=avg_m)
+        np.multiply(avg_m_in_s, avg_m, out=avg_s_eff)
+        np.multiply(1 - avg_m_in_s, avg_s, out=t1)
+        np.add(avg_s_eff, t1, out=avg_s_eff)
+
+    gc_i = 0.0
+    return kernel
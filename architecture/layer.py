@@ -6,12 +6,18 @@ Singular layer dynamics
 
 import numpy as np
 
-from .neuron import Neuron, INPUT, HIDDEN, OUTPUT
+from .neuron import Neuron, NeuronView, nxx1, INPUT, HIDDEN, OUTPUT
+from .logs import make_logs
 
 
 # TODO: Become layer, be an input/hidden/output layer
 class Layer:
 
+    # State arrays of the neurons, and state of the inhibition (per pattern when running batches)
+    state_names = ('g_e', 'I_net', 'I_net_r', 'v_m', 'v_m_eq', 'act', 'act_nd', 'act_m', 'adapt_curr', 'did_spike',
+                   'avg_ss', 'avg_s', 'avg_m', 'avg_l', 'avg_s_eff', 'net_raw_input', 'act_ext', 'clamped',
+                   'gc_i', 'ffi', 'fbi', 'avg_act')
+
     def __init__(self, size, neuron_type=HIDDEN, name=None, **kwargs):
         # What type of neurons are in this layer
         self.neuron_type = neuron_type
@@ -19,8 +25,49 @@ class Layer:
         # Set the name of this layer
         self.name = name
 
-        # Create the neurons of the layer, with number denoted by input parameter 'size'
-        self.neurons = [Neuron(neuron_type=neuron_type) for _ in range(size)]
+        # Number of neurons in the layer
+        self.size = size
+
+        # Prototype neuron holding the parameters shared by all neurons of the layer
+        self.unit = Neuron(neuron_type=neuron_type, log_names=())
+
+        # The state of the neurons is stored as one array per variable, and the layer advances all of them at once
+        self.g_e = np.zeros(size)
+        self.I_net = np.zeros(size)
+        self.I_net_r = np.zeros(size)
+        self.v_m = np.zeros(size)
+        self.v_m_eq = np.zeros(size)
+        self.act = np.zeros(size)
+        self.act_nd = np.zeros(size)
+        self.act_m = np.zeros(size)
+        self.adapt_curr = np.zeros(size)
+        self.did_spike = np.zeros(size)
+
+        # Cascaded averages for learning
+        self.avg_ss = np.full(size, self.unit.avg_init)
+        self.avg_s = np.full(size, self.unit.avg_init)
+        self.avg_m = np.full(size, self.unit.avg_init)
+        self.avg_l = np.full(size, self.unit.avg_l_init)
+        self.avg_s_eff = np.zeros(size)
+
+        # Sum of the excitatory inputs received by each neuron for the next step
+        self.net_raw_input = np.zeros(size)
+        # Forced activities, only meaningful where clamped is True
+        self.act_ext = np.zeros(size)
+        self.clamped = np.zeros(size, dtype=bool)
+
+        # Number of patterns simulated at once. None for a single pattern, otherwise the state arrays above have a
+        # leading batch axis of that size
+        self.batch_size = None
+        # State of the single pattern, kept aside while running batches
+        self._single_state = None
+        # Activities and equilibrium potentials at the previous settle_change call
+        self._settle_prev = None
+
+        self.reset_neurons()
+
+        # Neurons of the layer, with number denoted by input parameter 'size'. Views on the arrays above
+        self.neurons = [NeuronView(self, i) for i in range(size)]
 
         # Projections from this layer to other layers
         self.outgoing_projections = []
@@ -60,6 +107,30 @@ class Layer:
         # Threshold for activating feed-forward inhibition
         self.ff0 = 0.1
 
+        ########### Warm start ###########
+
+        # Reset calculation value for the state of the neurons (g_e, v_m, v_m_eq, act, adaptation) at the start of every
+        # cycle. If 1.0, the neurons reset to their initial state; below 1.0, they only decay toward it, so the next
+        # pattern starts from the settled state of the previous one (warm start)
+        self.state_reset = 1.0
+
+        ########### Clamped layers ###########
+
+        # Skip the steps of the layer while all its neurons are clamped, as their state does not change (unless the
+        # layer has logs). Steps then only clear the inputs of the layer, its inhibition is left as it is, and the
+        # averages for learning are updated once for all the steps, at the end of the quarter
+        self.skip_clamped = True
+        # If the layer skips its steps in the current quarter, and the number of steps skipped that update the averages
+        self.frozen = False
+        self.frozen_steps = 0
+
+        ########### Topography ###########
+
+        # Arrangement of the neurons on a 2D grid, as (rows, cols), used by the topographic projections. None for a
+        # square grid, or a single row if the size is not a square. Layers made of several feature maps of the same
+        # grid (e.g. one per kernel of a convolutional projection) use (maps, rows, cols)
+        self.geometry = None
+
         ########### TODO: Average activity parameters ###########
 
         # Target for adapting inhibition, initial estimated average value level
@@ -77,30 +148,141 @@ class Layer:
         self.avg_act = 0.0
         self.avg_act_p_eff = self.avg_act_targ_init
 
+        ########### Logs ###########
+
+        # Variables recorded after every step, none by default. Neuron variables ('act', 'v_m', 'net_input', ...) are
+        # recorded for the neurons in log_neurons, other names are layer variables ('gc_i', 'ffi', 'fbi', 'avg_act').
+        # A dict {name: every} records a variable only once every `every` steps
+        self.log_names = ()
+        # Indices of the neurons to record, None for all of them
+        self.log_neurons = None
+        # Number of records kept per variable, older records are overwritten
+        self.log_capacity = 1000
+
         ########### Utility ###########
 
         for key, value in kwargs.items():
             assert hasattr(self, key)  # making sure the parameter exists.
             setattr(self, key, value)
 
-        # Log inhibitory conductance
-        self.logs = {'gc_i': []}
+        # Logs of the recorded variables, in preallocated ring buffers
+        self.logs = {}
+        self.init_logs()
 
     # Return the matrix of activities for neurons in this layer
     @property
     def activities(self):
-        return [n.act for n in self.neurons]
+        return self.act
+
+    # Shape (maps, rows, cols) of the feature maps of the layer, neurons numbered map by map, then row by row
+    @property
+    def map_shape(self):
+        if self.geometry is not None:
+            shape = tuple(self.geometry) if len(self.geometry) == 3 else (1,) + tuple(self.geometry)
+            assert shape[0] * shape[1] * shape[2] == self.size
+            return shape
+        side = int(round(np.sqrt(self.size)))
+        return (1, side, side) if side * side == self.size else (1, 1, self.size)
+
+    # Shape (rows, cols) of the grid of neurons, numbered row by row. Feature maps are stacked vertically
+    @property
+    def grid_shape(self):
+        maps, rows, cols = self.map_shape
+        return maps * rows, cols
 
     # Return the matrix of net excitatory input for neurons in this layer
     @property
     def net_inputs(self):
-        return [n.g_e for n in self.neurons]
+        return self.g_e
 
-    # Set the neuron's activities equal to the inputs
+    # Set the neuron's activities equal to the inputs. One row of activities per pattern when running batches
     def force_activity(self, activities):
-        assert len(activities) == len(self.neurons)
-        for n, act in zip(self.neurons, activities):
-            n.force_activity(act)
+        assert np.shape(activities)[-1] == self.size
+        self.force_activity_at(slice(None), np.asarray(activities, dtype=float))
+
+    # Force the activity of the neurons at index (an integer, slice or mask). See Neuron.force_activity
+    def force_activity_at(self, index, act_ext):
+        u = self.unit
+        index = (Ellipsis, index)
+        assert not np.any(self.net_raw_input[index])
+
+        self.clamped[index] = True
+        self.act_ext[index] = act_ext
+
+        self.g_e[index] = act_ext / u.g_bar_e
+        self.I_net[index] = 0.0
+        self.act[index] = act_ext
+        self.act_nd[index] = act_ext
+        self.v_m[index] = np.where(np.equal(act_ext, 0), u.e_l, u.act_thr + np.divide(act_ext, u.act_gain))
+        self.v_m_eq[index] = self.v_m[index]
+
+    # Reset the state of the neurons at index (all by default). See Neuron.reset
+    def reset_neurons(self, index=slice(None)):
+        index = (Ellipsis, index)
+        self.net_raw_input[index] = 0.0
+
+        self.g_e[index] = 0.0
+        self.I_net[index] = 0.0
+        self.I_net_r[index] = 0.0
+        self.v_m[index] = self.unit.v_m_init
+        self.v_m_eq[index] = self.unit.v_m_init
+        self.act[index] = 0.0
+        self.adapt_curr[index] = 0.0
+
+        self.clamped[index] = False
+        self.act_nd[index] = 0.0
+        self.act_m[index] = 0.0
+
+    # Decay the state of all the neurons toward their initial state by the fraction decay (1.0 is a full reset). Forced
+    # activities and pending inputs are always cleared
+    def decay_neurons(self, decay):
+        u = self.unit
+        for name, init in (('g_e', 0.0), ('v_m', u.v_m_init), ('v_m_eq', u.v_m_init), ('act', 0.0), ('act_nd', 0.0),
+                           ('adapt_curr', 0.0)):
+            value = getattr(self, name)
+            value -= decay * (value - init)
+
+        self.net_raw_input[...] = 0.0
+        self.I_net[...] = 0.0
+        self.I_net_r[...] = 0.0
+        self.clamped[...] = False
+        self.act_m[...] = 0.0
+
+    # Simulate batch_size patterns at once, or a single pattern if None. Every pattern of the batch starts from the
+    # state of the single pattern, which is restored when leaving batch mode
+    def set_batch_size(self, batch_size):
+        if batch_size == self.batch_size:
+            return
+
+        if self.batch_size is None:
+            self._single_state = {name: getattr(self, name) for name in self.state_names}
+
+        for name, value in self._single_state.items():
+            if batch_size is not None:
+                # Neuron arrays get a leading batch axis, inhibition values become one value per pattern
+                value = np.repeat(np.reshape(value, (1, -1)), batch_size, axis=0)
+            setattr(self, name, value)
+
+        self.batch_size = batch_size
+        if batch_size is None:
+            self._single_state = None
+
+    # Largest change of act or v_m_eq (over all neurons and patterns) since the previous call. Used to detect when the
+    # layer has settled
+    def settle_change(self):
+        if self._settle_prev is None or self._settle_prev[0].shape != self.act.shape:
+            self._settle_prev = self.act.copy(), self.v_m_eq.copy()
+            return np.inf
+
+        prev_act, prev_v_m_eq = self._settle_prev
+        change = max(np.max(np.abs(self.act - prev_act)), np.max(np.abs(self.v_m_eq - prev_v_m_eq)))
+        prev_act[...] = self.act
+        prev_v_m_eq[...] = self.v_m_eq
+        return change
+
+    # Average of values over the neurons of the layer. One average per pattern (as a column) when running batches
+    def _mean(self, values):
+        return np.mean(values, axis=-1, keepdims=np.ndim(values) > 1)
 
 
     ################  Inhibition  ################
@@ -113,7 +295,7 @@ class Layer:
             # Retrieve net inputs of neurons in this layer for feed-forward inhibition
             _net_inputs = self.net_inputs
             # Calculate feed-forward inhibition
-            self.ffi = self.ff * max(0, np.mean(_net_inputs) - self.ff0)
+            self.ffi = self.ff * np.maximum(0, self._mean(_net_inputs) - self.ff0)
 
             # Calculate feed-back inhibition
             self.fbi += self.fb_dt * (self.fb * self.avg_act - self.fbi)
@@ -127,23 +309,30 @@ class Layer:
     ################  Temporal process control  ################
 
 
-    # Advance the layer one time-step, and all the neurons in it
-    def step(self, phase):
+    # Advance the layer one time-step, and all the neurons in it. Without learning, the averages for learning are not
+    # updated
+    def step(self, phase, learning=True):
+
+        # Fully clamped layer: nothing to compute until the end of the quarter
+        if self.frozen:
+            self.net_raw_input[...] = 0.0
+            if learning:
+                self.frozen_steps += 1
+            self.step_count += 1
+            return
 
         # Calculate the net inputs for the neurons this layer
-        for n in self.neurons:
-            n.calculate_net_input()
+        self.calculate_net_input()
 
         # Inhibition happens during minus phase; minus phase: network runs free, plus phase: network is clamped to value
         if phase == 'minus':
             self.gc_i = self.inhibition()
 
         # Advance the neurons in the layer one time-step, set their inhibition
-        for n in self.neurons:
-            n.step(phase, g_i=self.gc_i)
+        self.step_neurons(g_i=self.gc_i, learning=learning)
 
         # Compute the average activity of the layer
-        self.avg_act = np.mean(self.activities)
+        self.avg_act = self._mean(self.act)
 
         # Update logs
         self.update_logs()
@@ -151,18 +340,156 @@ class Layer:
         # Indicate that the layer has been advanced one time-step
         self.step_count += 1
 
+    # Start of a quarter: skip the steps of the quarter if all neurons are clamped. See skip_clamped
+    def freeze(self):
+        self.frozen = self.skip_clamped and not self.logs and bool(np.all(self.clamped))
+        self.frozen_steps = 0
+        if self.frozen:
+            self.avg_act = self._mean(self.act)
+
+    # End of a quarter: catch up on the averages for learning of the steps skipped
+    def unfreeze(self):
+        if self.frozen_steps:
+            self.update_avgs(self.frozen_steps)
+        self.frozen = False
+        self.frozen_steps = 0
+
     # Initialize the layer for a new cycle
     def cycle_init(self):
 
-        # Reset all neurons
-        for u in self.neurons:
-            u.reset()
+        # Reset all neurons; change state_reset to value below 1.0 to make them keep part of their state
+        if self.state_reset == 1.0:
+            self.reset_neurons()
+        else:
+            self.decay_neurons(self.state_reset)
 
         # Reset inhibition; change inhib_reset to value below 1.0 to make it not reset to zero
         self.ffi -= self.inhib_reset * self.ffi
         self.fbi -= self.inhib_reset * self.fbi
 
 
+    ################  Neuron dynamics (vectorized Neuron.step)  ################
+
+
+    # Integrate the excitatory inputs received since the last step into g_e. See Neuron.calculate_net_input
+    def calculate_net_input(self):
+        u = self.unit
+
+        # Neurons with forced activity ignore their inputs
+        g_e = self.g_e + u.integ_dt * u.net_input_dt * (self.net_raw_input - self.g_e)
+        np.copyto(self.g_e, g_e, where=~self.clamped)
+
+        # Clear the excitatory inputs for the next step
+        self.net_raw_input[:] = 0.0
+
+    # Update the activity of all the neurons one time-step. See Neuron.step
+    def step_neurons(self, g_i=0.0, learning=True):
+        u = self.unit
+        free = ~self.clamped
+
+        # Input conductances
+        gc_e = u.g_bar_e * self.g_e
+        gc_i = u.g_bar_i * g_i
+        gc_l = u.g_bar_l * u.g_l
+
+        # Net current, half-step integration, and its rate-coded version, one-step integration
+        I_net = self.calculate_net_current(self.v_m, gc_e, gc_i, gc_l, steps=2)
+        I_net_r = self.calculate_net_current(self.v_m_eq, gc_e, gc_i, gc_l, steps=1)
+
+        # Update v_m (membrane potential) and v_m_eq (equilibrium membrane potential)
+        v_m = self.v_m + u.integ_dt * u.v_m_dt * I_net
+        v_m_eq = self.v_m_eq + u.integ_dt * u.v_m_dt * I_net_r
+
+        # Reset v_m if it crosses the threshold
+        did_spike = v_m > u.act_thr
+        v_m[did_spike] = u.v_m_r
+        I_net[did_spike] = 0.0
+
+        # Computing new_act from v_m_eq below threshold, from the excitatory conductance above
+        g_e_thr = (gc_i * (u.e_i - u.act_thr) + gc_l * (u.e_l - u.act_thr) - self.adapt_curr) / (u.act_thr - u.e_e)
+        new_act = self.nxx1(np.where(v_m_eq <= u.act_thr, v_m_eq - u.act_thr, gc_e - g_e_thr))
+
+        # Update activity
+        act_nd = self.act_nd + u.integ_dt * u.v_m_dt * (new_act - self.act_nd)
+
+        # Update adaptation
+        if u.adapt_on:
+            adapt_curr = self.adapt_curr + u.integ_dt * (u.adapt_dt * (u.v_m_gain * (v_m - u.e_l) - self.adapt_curr)
+                                                         + did_spike * u.spike_gain)
+            np.copyto(self.adapt_curr, adapt_curr, where=free)
+
+        # Neurons with forced activity keep their state
+        np.copyto(self.I_net, I_net, where=free)
+        np.copyto(self.I_net_r, I_net_r, where=free)
+        np.copyto(self.v_m, v_m, where=free)
+        np.copyto(self.v_m_eq, v_m_eq, where=free)
+        np.copyto(self.did_spike, did_spike, where=free)
+        np.copyto(self.act_nd, act_nd, where=free)
+        # TODO: Implement stp
+        np.copyto(self.act, act_nd, where=free)
+
+        if learning:
+            self.update_avgs()
+
+    # Net current for membrane potentials v_m_eff, integrated in the given number of steps
+    def calculate_net_current(self, v_m_eff, gc_e, gc_i, gc_l, steps=1):
+        u = self.unit
+
+        new_I_net = 0.0
+        for _ in range(steps):
+            new_I_net = (gc_e * (u.e_e - v_m_eff) + gc_i * (u.e_i - v_m_eff)
+                         + gc_l * (u.e_l - v_m_eff) - self.adapt_curr)
+            v_m_eff = v_m_eff + u.integ_dt / steps * u.v_m_dt * new_I_net
+
+        return new_I_net
+
+    # Noisy xx1 activation function of an array of membrane potentials
+    def nxx1(self, v_m):
+        return nxx1(v_m, self.unit.act_gain, self.unit.act_sd, self.unit.nxx1_res)
+
+
+    ################  Updating averages of activation (for learning)  ################
+
+
+    # Update all the averages except long-term at the end of every step. See Neuron.update_avgs
+    def update_avgs(self, steps=1):
+        u = self.unit
+        if steps == 1:
+            self.avg_ss += u.integ_dt * u.avg_ss_dt * (self.act_nd - self.avg_ss)
+            self.avg_s += u.integ_dt * u.avg_s_dt * (self.avg_ss - self.avg_s)
+            self.avg_m += u.integ_dt * u.avg_m_dt * (self.avg_s - self.avg_m)
+
+        # Several steps at once, with act_nd constant over the steps (clamped neurons): one step is a linear map of
+        # (avg_ss, avg_s, avg_m, act_nd), applied `steps` times as a matrix power
+        else:
+            a, b, c = u.integ_dt * u.avg_ss_dt, u.integ_dt * u.avg_s_dt, u.integ_dt * u.avg_m_dt
+            update = np.array([[1 - a, 0, 0, a],
+                               [b * (1 - a), 1 - b, 0, b * a],
+                               [c * b * (1 - a), c * (1 - b), 1 - c, c * b * a],
+                               [0, 0, 0, 1]])
+            avgs = np.tensordot(np.linalg.matrix_power(update, steps),
+                                np.stack((self.avg_ss, self.avg_s, self.avg_m, self.act_nd)), axes=1)
+            self.avg_ss[...], self.avg_s[...], self.avg_m[...] = avgs[0], avgs[1], avgs[2]
+
+        self.avg_s_eff[:] = u.avg_m_in_s * self.avg_m + (1 - u.avg_m_in_s) * self.avg_s
+
+    # Long-term average, calculated at the end of every cycle. See Neuron.update_avg_l
+    def update_avg_l(self):
+        u = self.unit
+        self.avg_l += u.avg_l_dt * (u.avg_l_gain * self.avg_m - self.avg_l)
+        np.maximum(self.avg_l, u.avg_l_min, out=self.avg_l)
+
+    # Self-organizing learning factor of every neuron. See Neuron.avg_l_lrn
+    @property
+    def avg_l_lrn(self):
+        u = self.unit
+        # No self-organization unless hidden layer
+        if self.neuron_type != HIDDEN:
+            return np.zeros_like(self.avg_l)
+        avg_fact = (u.avg_lrn_max - u.avg_lrn_min) / (u.avg_l_gain - u.avg_l_min)
+        return u.avg_lrn_min + avg_fact * (self.avg_l - u.avg_l_min)
+
+
     ################  Logs/config  ################
 
 
@@ -175,6 +502,28 @@ class Layer:
         for name in ['gc_i', 'fbi', 'ffi']:
             print('   {}: {:.2f}'.format(name, getattr(self, name)))
 
+    # (Re)create the logs from log_names, log_neurons and log_capacity. Call after changing them
+    def init_logs(self):
+        self.logs.clear()
+        self.logs.update(make_logs(self.log_names, self.log_capacity))
+
+    # Whether a logged variable is a neuron variable (one value per recorded neuron) or a layer variable
+    @staticmethod
+    def is_neuron_log(name):
+        return name == 'net_input' or name in NeuronView.state_names
+
     # Record the layer's current state. Called after each step
     def update_logs(self):
-        self.logs['gc_i'].append(self.gc_i)
\ No newline at end of file
+        for name, log in self.logs.items():
+            if log.due():
+                log.append(self._log_value(name))
+
+    # Current value of a logged variable
+    def _log_value(self, name):
+        if not self.is_neuron_log(name):
+            return getattr(self, name)
+
+        index = slice(None) if self.log_neurons is None else list(self.log_neurons)
+        if name == 'net_input':
+            return self.unit.g_bar_e * self.g_e[..., index]
+        return getattr(self, name)[..., index]
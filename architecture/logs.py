@@ -0,0 +1,83 @@
+"""
+
+Bounded logs of neuron and layer variables
+
+"""
+
+import numpy as np
+
+
+# Log of one variable in a preallocated ring buffer. Keeps the most recent `capacity` records, and only records one step
+# out of `every`. Behaves like a sequence of the records, oldest first
+class RingLog:
+
+    def __init__(self, capacity=1000, every=1):
+        assert capacity > 0 and every > 0
+
+        # Maximum number of records kept; older records are overwritten
+        self.capacity = capacity
+        # Decimation factor: record once every `every` steps
+        self.every = every
+
+        # Preallocated on the first record, once the shape of the variable is known
+        self.buffer = None
+        # Number of records written, including the overwritten ones
+        self.count = 0
+        # Number of steps seen, recorded or not
+        self.steps = 0
+
+    # Advance the log one step. Return True if the value of this step should be recorded
+    def due(self):
+        due = self.steps % self.every == 0
+        self.steps += 1
+        return due
+
+    # Record a value (a number, or an array of fixed shape)
+    def append(self, value):
+        value = np.asarray(value, dtype=float)
+
+        # Allocate, or start over if the shape changed (e.g. when a layer switches to batch mode)
+        if self.buffer is None or self.buffer.shape[1:] != value.shape:
+            self.buffer = np.empty((self.capacity,) + value.shape)
+            self.count = 0
+
+        self.buffer[self.count % self.capacity] = value
+        self.count += 1
+
+    # Forget all records
+    def clear(self):
+        self.count = 0
+        self.steps = 0
+
+    # The records kept, oldest first
+    def values(self):
+        if self.buffer is None:
+            return np.empty(0)
+        if self.count <= self.capacity:
+            return self.buffer[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+
+    # Step number of each record kept
+    def times(self):
+        return self.every * np.arange(self.count - len(self), self.count)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.values()
+        return values if dtype is None else values.astype(dtype)
+
+
+# Create the logs for log_names: a sequence of names recorded every step, or a dict {name: every}
+def make_logs(log_names, capacity=1000):
+    if not isinstance(log_names, dict):
+        log_names = {name: 1 for name in log_names}
+    return {name: RingLog(capacity, every) for name, every in log_names.items()}
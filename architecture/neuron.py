@@ -5,7 +5,8 @@ Generate one layer of neurons
 """
 
 import numpy as np
-import scipy.interpolate
+
+from .logs import make_logs
 
 # What type of neuron this is
 INPUT = 0
@@ -13,10 +14,76 @@ HIDDEN = 1
 OUTPUT = 2
 
 
+################  Noisy xx1 activation function  ################
+
+
+# Look-up tables of the noisy xx1 function, keyed by (act_gain, act_sd, resolution) and shared by all neurons
+_nxx1_tables = {}
+
+
+# Pre-compute the convolution for the noisy xx1 function as a look-up table. Computed once per set of parameters
+def nxx1_table(act_gain, act_sd, resolution=0.001):
+    key = (act_gain, act_sd, resolution)
+    if key not in _nxx1_tables:
+
+        # Compute the gaussian
+        ns_rng = max(3.0 * act_sd, resolution)
+        # x represents v_m
+        xs = np.arange(-ns_rng, ns_rng + resolution, resolution)
+        var = max(act_sd, 1.0e-6) ** 2
+        # Compute unscaled gaussian
+        gaussian = np.exp(-xs ** 2 / var)
+        # Normalize
+        gaussian = gaussian / sum(gaussian)
+
+        # Compute the xx1 function
+        xs = np.arange(-2 * ns_rng, 1.0 + ns_rng + resolution, resolution)
+        x2 = act_gain * np.maximum(xs, 0)
+        xx1 = x2 / (x2 + 1)
+
+        # Convolution
+        conv = np.convolve(xx1, gaussian, mode='same')
+
+        # Clamp to valid range
+        xs_valid = np.arange(-ns_rng, 1.0 + resolution, resolution)
+        conv = conv[np.searchsorted(xs, xs_valid[0], side='left'):
+                    np.searchsorted(xs, xs_valid[-1], side='right')]
+        assert len(xs_valid) == len(conv), '{} != {}'.format(len(xs_valid), len(conv))
+
+        # Read-only, since the table is shared
+        xs_valid.flags.writeable = False
+        conv.flags.writeable = False
+        _nxx1_tables[key] = xs_valid, conv
+
+    return _nxx1_tables[key]
+
+
+# Noisy xx1 function of a value or an array of values (v_m_eq or g_e - threshold, relative to act_thr)
+def nxx1(v_m, act_gain, act_sd, resolution=0.001):
+    xs, conv = nxx1_table(act_gain, act_sd, resolution)
+    v_m = np.asarray(v_m, dtype=float)
+
+    # Inside the table: linear interpolation
+    act = np.array(np.interp(v_m, xs, conv))
+    # Below the table: no activity
+    act[v_m < xs[0]] = 0.0
+    # Above the table: the noise is negligible, calculate the xx1 function
+    # TODO: g_e_theta instead of v_m?
+    tail = xs[-1] < v_m
+    x = act_gain * np.maximum(v_m[tail], 0.0)
+    act[tail] = x / (x + 1)
+
+    if act.ndim == 0:
+        return float(act)
+    return act
+
+
 class Neuron:
 
+    # log_names: variables recorded after every step, or a dict {name: every} to record once every `every` steps.
+    # Each log keeps the last log_capacity records
     def __init__(self, neuron_type=HIDDEN, log_names=('net_input', 'I_net', 'v_m', 'act', 'v_m_eq', 'adapt_curr'),
-                 **kwargs):
+                 log_capacity=10000, **kwargs):
 
         # What type of neuron this is
         self.neuron_type = neuron_type
@@ -59,6 +126,9 @@ class Neuron:
         # Standard deviation for computing the noisy gaussian
         self.act_sd = 0.01
 
+        # Resolution of the precomputed nxx1 look-up table
+        self.nxx1_res = 0.001
+
         # TODO: Clamp ranges; NXX1 can't reach 1, so clamp to 0.95
         self.act_min = 0.0
         self.act_max = 0.95
@@ -126,11 +196,8 @@ class Neuron:
             assert hasattr(self, key), 'the {} parameter does not exist'.format(key)
             setattr(self, key, value)
 
-        # If the convolution table for nxx1 has been precomputed
-        self.nxx1_table = None
-
         self.log_names = log_names
-        self.logs = {name: [] for name in self.log_names}
+        self.logs = make_logs(log_names, log_capacity)
 
         # Reset to initialize the neuron
         self.reset()
@@ -197,50 +264,14 @@ class Neuron:
     ################  Utility functions  ################
 
 
-    # Pre-compute the convolution for the noisy xx1 function as a look-up table
+    # Noisy xx1 activation function, evaluated from the look-up table shared by neurons with the same parameters
     def nxx1(self, v_m):
+        return nxx1(v_m, self.act_gain, self.act_sd, self.nxx1_res)
 
-        # If we have not precomputed the table yet
-        if self.nxx1_table is None:
-            # Resolution of the precomputed array
-            resolution = 0.001
-
-            # Compute the gaussian
-            ns_rng = max(3.0 * self.act_sd, resolution)
-            # x represents v_m
-            xs = np.arange(-ns_rng, ns_rng + resolution, resolution)
-            var = max(self.act_sd, 1.0e-6) ** 2
-            # Compute unscaled gaussian
-            gaussian = np.exp(-xs ** 2 / var)
-            # Normalize
-            gaussian = gaussian / sum(gaussian)
-
-            # Compute the xx1 function
-            xs = np.arange(-2 * ns_rng, 1.0 + ns_rng + resolution, resolution)
-            x2 = self.act_gain * np.maximum(xs, 0)
-            xx1 = x2 / (x2 + 1)
-
-            # Convolution
-            conv = np.convolve(xx1, gaussian, mode='same')
-
-            # Clamp to valid range
-            xs_valid = np.arange(-ns_rng, 1.0 + resolution, resolution)
-            conv = conv[np.searchsorted(xs, xs_valid[0], side='left'):
-                        np.searchsorted(xs, xs_valid[-1], side='right')]
-            assert len(xs_valid) == len(conv), '{} != {}'.format(len(xs_valid), len(conv))
-
-            self.nxx1_table = xs_valid, conv
-
-        xs, conv = self.nxx1_table
-        if v_m < xs[0]:
-            return 0.0
-        elif xs[-1] < v_m:
-            # Calculate the xx1 function
-            # TODO: g_e_theta instead of v_m?
-            x = self.act_gain * max(v_m, 0.0)
-            return x / (x + 1)
-        else:
-            return float(scipy.interpolate.interp1d(xs, conv, kind='linear', fill_value='extrapolate')(v_m))
+    # The precomputed (v_m, nxx1) look-up table used by this neuron
+    @property
+    def nxx1_table(self):
+        return nxx1_table(self.act_gain, self.act_sd, self.nxx1_res)
 
 
     ################  Neuron "integrate and fire" functions  ################
@@ -371,8 +402,9 @@ class Neuron:
 
     # Record the current state of the neuron. Called after each step
     def update_logs(self):
-        for name in self.logs.keys():
-            self.logs[name].append(getattr(self, name))
+        for name, log in self.logs.items():
+            if log.due():
+                log.append(getattr(self, name))
 
     # Show the neuron's configurations
     def show_config(self):
@@ -382,4 +414,79 @@ class Neuron:
             print('   {}: {:.2f}'.format(name, getattr(self, name)))
         print('State:')
         for name in ['g_e', 'I_net', 'v_m', 'act', 'v_m_eq']:
-            print('   {}: {:.2f}'.format(name, getattr(self, name)))
\ No newline at end of file
+            print('   {}: {:.2f}'.format(name, getattr(self, name)))
+
+
+# A neuron whose state lives in the arrays of a vectorized layer. Reading or writing a state variable goes straight to
+# the layer's arrays, parameters are shared with the layer's prototype neuron (layer.unit)
+class NeuronView(Neuron):
+
+    # State variables that the layer stores as one array per variable
+    state_names = ('g_e', 'I_net', 'I_net_r', 'v_m', 'v_m_eq', 'act', 'act_nd', 'act_m', 'adapt_curr', 'did_spike',
+                   'avg_ss', 'avg_s', 'avg_m', 'avg_l', 'avg_s_eff')
+
+    def __init__(self, layer, index):
+        # The layer holding the state, and the position of this neuron in its arrays
+        self.layer = layer
+        self.index = index
+
+    # Parameters are not stored per neuron; anything not found on the view is looked up on the prototype neuron
+    def __getattr__(self, name):
+        if name in ('layer', 'index'):
+            raise AttributeError(name)
+        return getattr(self.layer.unit, name)
+
+    # Forced activity, None if the neuron is not clamped
+    @property
+    def act_ext(self):
+        if np.all(self.layer.clamped[..., self.index]):
+            return self.layer.act_ext[..., self.index][()]
+        return None
+
+    # Logged values of this neuron, extracted from the layer's logs. Empty if the layer does not record this neuron
+    @property
+    def logs(self):
+        layer = self.layer
+        if layer.log_neurons is None:
+            column = self.index
+        elif self.index in layer.log_neurons:
+            column = list(layer.log_neurons).index(self.index)
+        else:
+            return {}
+        return {name: log.values()[..., column] for name, log in layer.logs.items() if layer.is_neuron_log(name)}
+
+    def reset(self):
+        self.layer.reset_neurons(self.index)
+
+    def force_activity(self, act_ext):
+        self.layer.force_activity_at(self.index, act_ext)
+
+    def add_excitatory(self, inp_act):
+        self.layer.net_raw_input[..., self.index] += inp_act
+
+    # The whole layer is advanced at once by Layer.step: a neuron of a layer cannot be advanced on its own
+    def calculate_net_input(self):
+        raise TypeError(self._layer_step_message('calculate_net_input'))
+
+    def step(self, phase, g_i=0.0):
+        raise TypeError(self._layer_step_message('step'))
+
+    def _layer_step_message(self, method):
+        return ("{}() of neuron {} of layer '{}': the neurons of a layer are advanced together, call Layer.step "
+                "instead".format(method, self.index, self.layer.name))
+
+
+# Map a state variable of the view to its element in the layer's array (one element per pattern when running batches)
+def _state_property(name):
+
+    def getter(self):
+        return getattr(self.layer, name)[..., self.index][()]
+
+    def setter(self, value):
+        getattr(self.layer, name)[..., self.index] = value
+
+    return property(getter, setter)
+
+
+for _name in NeuronView.state_names:
+    setattr(NeuronView, _name, _state_property(_name))
@@ -0,0 +1,84 @@
+"""
+
+Connection patterns of topographic projections between 2D layers
+
+Each function returns the (pre index, post index) of every connection, with neurons numbered row by row on the grid
+of their layer
+
+"""
+
+import numpy as np
+
+
+# Grid positions (rows, cols) of the neurons of a grid of the given shape
+def _positions(shape):
+    rows, cols = np.divmod(np.arange(shape[0] * shape[1]), shape[1])
+    return rows, cols
+
+
+# Receptive fields: each post-neuron receives from a rf_size window of the pre-layer. The windows of neighbouring
+# post-neurons are stride pre-neurons apart, or spread evenly over the pre-layer if stride is None. With
+# shape='circle', only the pre-neurons inside the circle inscribed in the window are connected
+def receptive_fields(pre_shape, post_shape, rf_size, stride=None, shape='rect'):
+    rf_h, rf_w = (rf_size, rf_size) if np.isscalar(rf_size) else rf_size
+    post_rows, post_cols = _positions(post_shape)
+
+    # Top-left corner of the window of every post-neuron
+    if stride is None:
+        # Centers evenly spread over the pre-layer
+        top = np.round((post_rows + 0.5) * pre_shape[0] / post_shape[0] - 0.5 - (rf_h - 1) / 2).astype(int)
+        left = np.round((post_cols + 0.5) * pre_shape[1] / post_shape[1] - 0.5 - (rf_w - 1) / 2).astype(int)
+    else:
+        stride_h, stride_w = (stride, stride) if np.isscalar(stride) else stride
+        top, left = post_rows * stride_h, post_cols * stride_w
+
+    # Offsets inside the window
+    dy, dx = np.meshgrid(np.arange(rf_h), np.arange(rf_w), indexing='ij')
+    dy, dx = dy.ravel(), dx.ravel()
+    if shape == 'circle':
+        inside = ((dy - (rf_h - 1) / 2) / (rf_h / 2)) ** 2 + ((dx - (rf_w - 1) / 2) / (rf_w / 2)) ** 2 <= 1.0
+        dy, dx = dy[inside], dx[inside]
+    elif shape != 'rect':
+        raise NotImplementedError(shape)
+
+    # Pre-neuron of every (post-neuron, offset) pair, dropping the ones outside the pre-layer
+    pre_rows = top[:, np.newaxis] + dy
+    pre_cols = left[:, np.newaxis] + dx
+    post_idx = np.broadcast_to(np.arange(len(top))[:, np.newaxis], pre_rows.shape)
+    valid = (pre_rows >= 0) & (pre_rows < pre_shape[0]) & (pre_cols >= 0) & (pre_cols < pre_shape[1])
+
+    return pre_rows[valid] * pre_shape[1] + pre_cols[valid], post_idx[valid]
+
+
+# Lateral connections between two layers with the same grid: each post-neuron receives from the pre-neurons within
+# radius of its own position. Also returns the distance of every connection
+def lateral(shape, radius, include_self=False):
+    r = int(np.floor(radius))
+    dy, dx = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing='ij')
+    dy, dx = dy.ravel(), dx.ravel()
+    dist = np.sqrt(dy ** 2 + dx ** 2)
+    inside = (dist <= radius) & ((dist > 0) | include_self)
+    dy, dx, dist = dy[inside], dx[inside], dist[inside]
+
+    post_rows, post_cols = _positions(shape)
+    pre_rows = post_rows[:, np.newaxis] + dy
+    pre_cols = post_cols[:, np.newaxis] + dx
+    post_idx = np.broadcast_to(np.arange(len(post_rows))[:, np.newaxis], pre_rows.shape)
+    dist = np.broadcast_to(dist, pre_rows.shape)
+    valid = (pre_rows >= 0) & (pre_rows < shape[0]) & (pre_cols >= 0) & (pre_cols < shape[1])
+
+    return pre_rows[valid] * shape[1] + pre_cols[valid], post_idx[valid], dist[valid]
+
+
+# Random fixed fan-in: each post-neuron receives from fan_in pre-neurons drawn at random with the numpy Generator rng,
+# without repetition
+def random_fan_in(pre_size, post_size, fan_in, rng):
+    assert fan_in <= pre_size
+    pre_idx = np.concatenate([rng.choice(pre_size, fan_in, replace=False) for _ in range(post_size)])
+    post_idx = np.repeat(np.arange(post_size), fan_in)
+    return pre_idx, post_idx
+
+
+# Size of the output of a convolution along one dimension, for an input of the given size
+def conv_output_size(size, kernel_size, stride=1, pad=0):
+    return (size + 2 * pad - kernel_size) // stride + 1
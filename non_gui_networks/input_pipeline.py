@@ -0,0 +1,55 @@
+"""
+
+Streaming input pipeline
+
+Generators of training patterns, ready to clamp as {layer name: activities} maps. The patterns are prepared in
+background threads (or processes) while the network runs its cycles
+
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+
+# Indices of n items, in a new random order every epoch: sampling without replacement within an epoch. Goes on forever
+# if epochs is None
+def permutations(n, epochs=None, seed=None):
+    rng = np.random.default_rng(seed)
+    epoch = 0
+    while epochs is None or epoch < epochs:
+        yield from rng.permutation(n).tolist()
+        epoch += 1
+
+
+# Shuffle a stream of items with a buffer of buffer_size items: every item yielded is drawn at random from the buffer,
+# and replaced by the next item of the stream
+def shuffle(items, buffer_size=100, seed=None):
+    rng = np.random.default_rng(seed)
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.integers(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+# Apply transform to every item of a stream in n_workers background threads (processes if processes is True, then
+# transform must be picklable), and yield the results in order. At most queue_size results are prepared ahead
+def prefetch(transform, items, n_workers=1, queue_size=8, processes=False):
+    pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(n_workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(transform, item))
+            if len(pending) >= queue_size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -1,59 +1,70 @@
+"""
 
+Retina/LGN preprocessing: difference of gaussians over images
 
-import math
+"""
+
+from functools import lru_cache
 
-import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 import scipy.signal as signal
 import numpy as np
-import skimage.transform, skimage.util
-
+import skimage.transform
+import skimage.util
 
-def calc_degree_of_gaussians(img):
 
-    img = mpimg.imread(img)
-    # extract grey values
-    img = img[:,:,0]
+# Receptive Field function, on arrays of coordinates
+def gaussian2D(x, y, sigma):
+    return (1.0/(1*np.pi*(sigma**2)))*np.exp(-(1.0/(2*(sigma**2)))*(x**2 + y**2))
 
-    # Receptive Field function
 
-    def gaussian2D(x, y, sigma):
-        return (1.0/(1*math.pi*(sigma**2)))*math.exp(-(1.0/(2*(sigma**2)))*(x**2 + y**2))
+# The mexican hat function is a difference of gaussians, which leads to an on-center, off-surround receptive field,
+# found in retinal cells and vision neurons. It becomes a basic edge detector
+def mexicanHat(x, y, sigma1, sigma2):
+    return gaussian2D(x, y, sigma1) - gaussian2D(x, y, sigma2)
 
-    # Since scipy's convolve function doesn't accept functions, we need to sample the function
 
-    # Make a matrix from the function
-    def receptiveFieldMatrix(func):
-        h = 30
-        g = np.zeros((h,h))
-        for xi in range(0,h):
-            for yi in range(0,h):
-                x = xi-h/2
-                y = yi-h/2
-                g[xi, yi] = func(x,y)
-        return g
+# Since scipy's convolve function doesn't accept functions, we need to sample the function. The size x size matrix of
+# the mexican hat, computed once per (sigma1, sigma2, size) and shared: it is read-only
+@lru_cache(maxsize=None)
+def receptive_field(sigma1, sigma2, size=30):
+    x, y = np.meshgrid(np.arange(size) - size / 2, np.arange(size) - size / 2, indexing='ij')
+    g = mexicanHat(x, y, sigma1, sigma2)
+    g.flags.writeable = False
+    return g
 
-    def plotFilter(fun):
-        g = receptiveFieldMatrix(fun)
-        plt.imshow(g, cmap=plt.get_cmap('gray'))
 
-    # The mexican hat function is a difference of gaussians, which leads to an on-center, off-surround receptive field,
-    # found in retinal cells and vision neurons. It becomes a basic edge detector
+# Run the filter that resembles the retina over an image (rows, cols), or a stack of images (..., rows, cols), at full
+# resolution. Convolution means applying the filter to the input: every neuron in the output layer is excited by nearby
+# image neurons
+def retina(images, sigma1=2, sigma2=3, size=30):
+    images = np.asarray(images, dtype=float)
+    kernel = receptive_field(sigma1, sigma2, size).reshape((1,) * (images.ndim - 2) + (size, size))
+    return signal.fftconvolve(images, kernel, mode='same', axes=(-2, -1))
 
 
-    def mexicanHat(x,y,sigma1,sigma2):
-        return gaussian2D(x,y,sigma1) - gaussian2D(x,y,sigma2)
+# Difference of gaussians of images, resized to shape
+def degree_of_gaussians(images, sigma1=2, sigma2=3, size=30, shape=(12, 12)):
+    img_hat = retina(images, sigma1, sigma2, size)
+    return skimage.transform.resize(img_hat, img_hat.shape[:-2] + tuple(shape))
 
 
-    # Create the filter that resembles the retina
-    plotFilter(lambda x,y: mexicanHat(x,y,3,4))
+# ON-center and OFF-center channels of an image or a stack of images, flattened to layer activities: the OFF channel is
+# the inverse of the ON channel
+def on_off(images, sigma1=2, sigma2=3, size=30, shape=(12, 12)):
+    on = degree_of_gaussians(images, sigma1, sigma2, size, shape)
+    on = on.reshape(on.shape[:-2] + (-1,))
+    return on, 1 - on
 
-    # And now we use our filter that resembles the retina and run it over the image.
-    # Convolution means applying the filter to the input. When applying the gaussian filter, every neuron in the output
-    # layer is excited by nearby image neurons. The result of the convolution can then also be visualized in an image
 
-    img_hat = signal.convolve(img,receptiveFieldMatrix(lambda x,y: mexicanHat(x,y,2,3)), mode='same')
-    img_hat = skimage.transform.resize(img_hat, (12 , 12))
+# Grey values of an image file, as floats in [0, 1] whatever the format of the file (JPG files are read as 0-255
+# integers, PNG files as floats)
+def grey_image(img):
+    img = skimage.util.img_as_float(mpimg.imread(img))
+    # extract grey values
+    return img if img.ndim == 2 else img[:,:,0]
 
-    return img_hat
 
+# Difference of gaussians of the grey values of an image file
+def calc_degree_of_gaussians(img):
+    return degree_of_gaussians(grey_image(img))
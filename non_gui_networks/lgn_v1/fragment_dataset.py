@@ -0,0 +1,89 @@
+"""
+
+Dataset of preprocessed image fragments
+
+The master images are tiled into fragments, and the ON/OFF difference of gaussians of every fragment is computed once
+and stored in a memory-mapped .npy file: training reads fragments without decoding or preprocessing anything, and
+without loading the whole dataset in memory
+
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from non_gui_networks.lgn_v1 import calc_gaussians
+
+
+# Where each fragment comes from: master image number, and position of its top-left corner in the image
+index_dtype = np.dtype([('image', np.int32), ('row', np.int32), ('col', np.int32)])
+
+
+# Fragments of size x size pixels of an image (rows, cols), taken every stride pixels. Returns the fragments
+# (n, size, size), as views on the image, and the rows and cols of their top-left corners
+def tile(image, size=50, stride=None):
+    stride = size if stride is None else stride
+    windows = sliding_window_view(image, (size, size))[::stride, ::stride]
+    rows, cols = np.meshgrid(np.arange(windows.shape[0]) * stride, np.arange(windows.shape[1]) * stride,
+                             indexing='ij')
+    return windows.reshape((-1, size, size)), rows.ravel(), cols.ravel()
+
+
+# Index file of the dataset at path
+def _index_path(path):
+    return os.path.splitext(path)[0] + '_index.npy'
+
+
+# Tile the master image files into fragments, and store the ON and OFF channels of every fragment in the .npy file at
+# path, as an array (fragments, 2, layer size). Images are processed one at a time, written directly to the file
+def build_dataset(image_files, path, size=50, stride=None, shape=(12, 12), dtype=np.float32):
+    stride = size if stride is None else stride
+
+    # Number of fragments of every image, from the image headers only
+    counts = []
+    for file in image_files:
+        with Image.open(file) as img:
+            cols, rows = img.size
+        counts.append(((rows - size) // stride + 1) * ((cols - size) // stride + 1))
+
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(sum(counts), 2, shape[0] * shape[1]))
+    index = np.empty(sum(counts), dtype=index_dtype)
+
+    start = 0
+    for i, (file, count) in enumerate(zip(image_files, counts)):
+        fragments, rows, cols = tile(calc_gaussians.grey_image(file), size, stride)
+        on, off = calc_gaussians.on_off(fragments, shape=shape)
+        data[start:start + count, 0] = on
+        data[start:start + count, 1] = off
+        index[start:start + count] = list(zip(np.full(count, i), rows, cols))
+        start += count
+
+    data.flush()
+    np.save(_index_path(path), index)
+    return FragmentDataset(path)
+
+
+# Fragments of a dataset built by build_dataset, memory-mapped read-only
+class FragmentDataset:
+
+    def __init__(self, path, seed=None):
+        # (fragments, 2, layer size): ON and OFF channels of every fragment
+        self.data = np.load(path, mmap_mode='r')
+        # Master image and position of every fragment
+        self.index = np.load(_index_path(path))
+        # Random generator of sample
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.data)
+
+    # ON and OFF channels of fragment i (or of an array of fragments)
+    def __getitem__(self, i):
+        fragment = self.data[i]
+        return fragment[..., 0, :], fragment[..., 1, :]
+
+    # ON and OFF channels of a random fragment, or of n random fragments
+    def sample(self, n=None):
+        return self[self.rng.integers(len(self), size=n)]
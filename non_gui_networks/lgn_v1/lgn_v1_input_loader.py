@@ -1,44 +1,57 @@
 
-import os, random
-from PIL import Image
-from non_gui_networks.lgn_v1 import calc_gaussians
-import matplotlib.pyplot as plt
+import os
 import numpy as np
-import skimage.transform, skimage.util
+from functools import partial
+from itertools import islice
+from non_gui_networks import input_pipeline
+from non_gui_networks.lgn_v1 import calc_gaussians, fragment_dataset
+from vision.pyramid import PyramidCache
 
 
+# Master images, and the dataset of their preprocessed fragments. The version in the file name changes with the
+# preprocessing, so that datasets built by an earlier version are not used (v2: grey values in [0, 1])
+folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lgn_v1_input")
+dataset_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lgn_v1_fragments_v2.npy")
+_dataset = None
 
-# Pick a random image fragment
-def pick_random_image():
-    folder = r"/Users/Michael/Documents/SeniorProject/NEXUS/non_gui_networks/lgn_v1/lgn_v1_image_fragments/"
 
-    a = random.choice(os.listdir(folder))
-    print(a)
-    file = folder + a
-    # x = list(Image.open(file).convert('L').getdata())
-    return file
+# Open the fragment dataset, building it from the master images the first time
+def load_dataset():
+    global _dataset
+    if _dataset is None:
+        if not os.path.exists(dataset_path):
+            # 50x50 image samples from the 4 600x450 images
+            images = [os.path.join(folder, "master_image{}.jpg".format(i + 1)) for i in range(4)]
+            fragment_dataset.build_dataset(images, dataset_path, size=50)
+        _dataset = fragment_dataset.FragmentDataset(dataset_path)
+    return _dataset
 
 
-# Perform degree of gaussians over a randomly selected image fragment
+# Degree of gaussians of a randomly selected image fragment: ON and OFF channels in shape 144 from 12x12
 def degree_of_gaussians():
-    # Load random image
-    image = pick_random_image()
-    # Perform degree of gaussian
-    image = calc_gaussians.calc_degree_of_gaussians(image)
-    # Put into shape 144 from 12x12
-    inverse = skimage.util.invert(image)
-    return np.ndarray.flatten(image), np.ndarray.flatten(inverse)
-
-"""
-# Extract 50x50 image samples from the 4 600x450 images
-# One-time use only; no need to create the image fragments more than once
-
-import cv2
-
-path = "/NEXUS/non_gui_networks/lgn_v1/lgn_v1_input/"
-for i in range(4):
-    img = cv2.imread(path + "/master_image{}.jpg".format(i+1))
-    for r in range(0,img.shape[0],50):
-        for c in range(0,img.shape[1],50):
-            cv2.imwrite(path+f"img{i}_{r}_{c}.png",img[r:r+50, c:c+50,:])
-"""
\ No newline at end of file
+    return load_dataset().sample()
+
+
+# Pyramids of the full resolution difference of gaussians of image files, so that LGN inputs of several resolutions
+# (a 12x12 LGN, a 24x24 LGN...) come from one decode and one convolution of every image
+dog_pyramids = PyramidCache(lambda img: calc_gaussians.retina(calc_gaussians.grey_image(img)))
+
+
+# ON and OFF channels of an image file at every shape (rows, cols) of shapes: a dict shape -> (on, off), flattened
+def multi_resolution(img, shapes=((12, 12), (24, 24))):
+    maps = dog_pyramids.resize(img, shapes)
+    return {shape: (on.ravel(), 1 - on.ravel()) for shape, on in maps.items()}
+
+
+# Input map of fragment i of the dataset, to clamp the LGN with
+def fragment_pattern(dataset, i):
+    on, off = dataset[i]
+    return {'LGN_ON': np.array(on, dtype=float), 'LGN_OFF': np.array(off, dtype=float)}
+
+
+# Stream of count input maps (endless if None): the fragments in a random order, without replacement until all of them
+# have been used, read in the background while the network trains
+def patterns(count=None, seed=None, queue_size=8):
+    dataset = load_dataset()
+    indices = input_pipeline.permutations(len(dataset), seed=seed)
+    return input_pipeline.prefetch(partial(fragment_pattern, dataset), islice(indices, count), queue_size=queue_size)
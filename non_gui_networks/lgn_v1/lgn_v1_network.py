@@ -21,12 +21,14 @@ V1 = new_network.add_layer(size=14, neuron_type="HIDDEN", name="V1", lay_inhib=T
 
 ################  Projections  ################
 
-new_network.add_projection("LGN_ON", "V1")
-new_network.add_projection("LGN_OFF", "V1")
+# Local receptive fields: each V1 neuron receives from a 5x5 window of the LGN, the windows spread over the LGN
+new_network.add_projection("LGN_ON", "V1", proj='rf', rf_size=5)
+new_network.add_projection("LGN_OFF", "V1", proj='rf', rf_size=5)
 # Recurrent Connection
 
 # Lateral inhibition
-# Tessel circle (lateral inhibition, in a circle that fades as a function of distance from the center)
+# Tessel circle (lateral inhibition, in a circle that fades as a function of distance from the center). The connection
+# pattern is proj='lateral' with lat_sigma set, waiting for inhibitory projections
 
 ################  Build  ################
 
@@ -35,19 +37,16 @@ new_network.build_network()
 ################  Load Input and Train  ################
 
 epochs = 5
-for i in range(epochs):
-    # Load degree of gaussians image fragment
-    image, inverse = lgn_v1_input_loader.degree_of_gaussians()
-
-    # Force activity of LGN with train_network
-    input_LGN_ON = {'LGN_ON': image}
-    input_LGN_OFF = {'LGN_OFF': inverse}
-    input_patterns = [input_LGN_ON, input_LGN_OFF]
-
-    # Train the network
-    new_network.train_network(input=input_patterns)
+# Degree of gaussians image fragments, loaded in the background while the network trains on the previous one
+for input_patterns in lgn_v1_input_loader.patterns(epochs):
+    # Force activity of LGN_ON and LGN_OFF with train_network
+    new_network.train_network(input=[input_patterns])
 
 
 ################  Test  ################
 
-# Grab receiving weights of V1 from LGN_ON
\ No newline at end of file
+# Grab receiving weights of V1 from LGN_ON
+# Read-only view on the weights (LGN_ON neurons x V1 neurons, a sparse matrix for receptive fields): column i holds the
+# receptive field of V1 neuron i
+LGN_ON_to_V1 = new_network.projections[0].weights
+rf_0 = LGN_ON_to_V1[:, 0].toarray().reshape(12, 12)
@@ -5,8 +5,6 @@ Recommended workflow is build network outside of GUI first, and then implement i
 
 
 from architecture import neuron, layer, connection, NEXUS
-import random
-random.seed(2)
 import numpy as np
 
 class network_runner:
@@ -22,6 +20,9 @@ class network_runner:
         self.projections = []
         self.network = None
 
+        # Seed of the weight initialization. Each projection gets its own seed, derived from this one
+        self.seed = 2
+
     ################  Layer control  ################
 
     def add_layer(self, size, name, neuron_type, lay_inhib, inhib_gain, ffi, fbi):
@@ -41,7 +42,8 @@ class network_runner:
 
     ################  Projection control  ################
 
-    def add_projection(self, from_layer, to_layer):
+    # Extra keyword arguments are projection parameters, e.g. proj='rf', rf_size=5
+    def add_projection(self, from_layer, to_layer, **kwargs):
 
         for i in self.layers:
             if from_layer == i.name:
@@ -50,7 +52,8 @@ class network_runner:
                 receiving_layer = i
 
         if sending_layer is not None and receiving_layer is not None:
-            newProjection = connection.Projection(sending_layer, receiving_layer)
+            kwargs.setdefault('seed', self.seed + len(self.projections))
+            newProjection = connection.Projection(sending_layer, receiving_layer, **kwargs)
             self.projections.append(newProjection)
         else:
             print("projection layer arguments error")
@@ -80,9 +83,10 @@ class network_runner:
         sse = self.network.cycle()
         print('{} sse={}'.format(self.network.cycle_count, sse))
 
-    # Test the network with one additional cycle, and return the resulting activities
+    # Test the network on an input pattern (inference only, no learning), and return the resulting activities.
+    # input_pattern can also be a (batch, units) array of patterns, all settled at once; one row of activities is
+    # returned per pattern
     def test_network(self, input_pattern):
-        assert len(self.network.layers[0].neurons) == len(input_pattern)
+        assert len(self.network.layers[0].neurons) == np.shape(input_pattern)[-1]
 
-        self.network.cycle()
-        return [neuron.act_m for neuron in self.network.layers[-1].neurons]
\ No newline at end of file
+        return self.network.infer({self.network.layers[0].name: input_pattern}).tolist()
\ No newline at end of file
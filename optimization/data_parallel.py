@@ -0,0 +1,213 @@
+"""
+
+Data-parallel training
+
+Worker processes each hold a replica of the network and run cycles on their own shard of the patterns. Their weights
+live in shared memory: after every round, the coordinator averages the weight changes accumulated by the workers,
+applies them once, and the workers see the new weights without any copy
+
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from . import shared
+
+
+# Make the projection use wt and fwt as its weight arrays
+def _use_weights(projection, wt, fwt):
+    projection.wt = wt
+    projection.fwt = fwt
+    # Views on the previous arrays
+    projection._wt_matrix = None
+    projection._synapses = None
+
+
+# Replicas of the network, one per worker process, trained on different patterns with shared weights
+class DataParallelTrainer:
+
+    def __init__(self, network, inputs, outputs=None, **kwargs):
+
+        # Network trained. Its weights are the ones learned; they live in shared memory until close() is called
+        self.network = network
+
+        ########### Parameters ###########
+
+        # Number of worker processes, one per core by default
+        self.n_workers = None
+        # Number of patterns each worker learns from before the weight changes are averaged and applied
+        self.sync_interval = 1
+        # Seed of the order of the patterns in every epoch
+        self.seed = None
+
+        for key, value in kwargs.items():
+            assert hasattr(self, key)
+            setattr(self, key, value)
+
+        if self.n_workers is None:
+            self.n_workers = multiprocessing.cpu_count()
+        self.rng = np.random.default_rng(self.seed)
+
+        # Shared memory blocks, kept open until close(), and the name of the block of every shared array
+        self._blocks = []
+        self._names = {}
+
+        # Patterns: dicts of layer name -> (patterns, layer size) arrays, shared read-only with the workers
+        self.n_patterns = len(next(iter(inputs.values())))
+        self.inputs = {name: self._share(np.asarray(acts, dtype=float)) for name, acts in inputs.items()}
+        self.outputs = {name: self._share(np.asarray(acts, dtype=float)) for name, acts in (outputs or {}).items()}
+
+        # Weights of the network moved to shared memory, and one slot of weight changes per worker
+        self.dwt = []
+        for projection in network.projections:
+            _use_weights(projection, self._share(projection.wt), self._share(projection.fwt))
+            self.dwt.append(self._share(np.zeros((self.n_workers,) + projection.dwt.shape)))
+        if network.plan is not None:
+            network.plan.compile()
+
+        # Start the workers, connected to the coordinator by pipes
+        specs = {
+            'inputs': {name: (self._name(acts), acts.shape) for name, acts in self.inputs.items()},
+            'outputs': {name: (self._name(acts), acts.shape) for name, acts in self.outputs.items()},
+            'weights': [(self._name(p.wt), self._name(p.fwt), p.wt.shape) for p in network.projections],
+            'dwt': [(self._name(dwt), dwt.shape) for dwt in self.dwt],
+        }
+        self.pipes = []
+        self.workers = []
+        for worker_id in range(self.n_workers):
+            pipe, worker_pipe = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_worker, args=(network, specs, worker_id, worker_pipe),
+                                             daemon=True)
+            worker.start()
+            self.pipes.append(pipe)
+            self.workers.append(worker)
+
+
+    ################  Shared memory  ################
+
+
+    # Copy of array in a new shared memory block
+    def _share(self, array):
+        shm, copy = shared.share(array)
+        self._blocks.append(shm)
+        self._names[id(copy)] = shm.name
+        return copy
+
+    # Name of the shared memory block of a shared array
+    def _name(self, array):
+        return self._names[id(array)]
+
+
+    ################  Training  ################
+
+
+    # Train the network for the given number of epochs. Returns the mean SSE of every epoch
+    def train(self, epochs=1):
+        sse = []
+        for _ in range(epochs):
+            sse.append(self.epoch())
+        return sse
+
+    # Present every pattern once, in a random order. Every round, each worker learns from sync_interval patterns, then
+    # the weight changes are averaged over the workers and applied. Returns the mean SSE over the patterns
+    def epoch(self):
+        order = self.rng.permutation(self.n_patterns)
+        round_size = self.n_workers * self.sync_interval
+
+        sse = 0.0
+        for start in range(0, self.n_patterns, round_size):
+            shards = np.array_split(order[start:start + round_size], self.n_workers)
+
+            # Workers run their cycles at the same time, with the current weights
+            busy = []
+            for pipe, shard in zip(self.pipes, shards):
+                if len(shard):
+                    pipe.send(('train', shard))
+                    busy.append(pipe)
+            for pipe in busy:
+                sse += pipe.recv()
+
+            self._update_weights(len(busy))
+
+        return sse / self.n_patterns
+
+    # Average the weight changes of the workers that took part in the round, and apply them to the shared weights
+    def _update_weights(self, n_busy):
+        for projection, dwt in zip(self.network.projections, self.dwt):
+            projection.dwt[...] = dwt[:n_busy].mean(axis=0)
+            projection.dwt_count = 1
+            projection.flush_dwt()
+            dwt[:n_busy] = 0.0
+
+
+    ################  Shutdown  ################
+
+
+    # Stop the workers, and move the weights of the network back to regular memory
+    def close(self):
+        for pipe in self.pipes:
+            pipe.send(('stop', None))
+        for worker in self.workers:
+            worker.join()
+        self.pipes, self.workers = [], []
+
+        for projection in self.network.projections:
+            _use_weights(projection, np.array(projection.wt), np.array(projection.fwt))
+        if self.network.plan is not None:
+            self.network.plan.compile()
+
+        self.inputs, self.outputs, self.dwt = {}, {}, []
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks, self._names = [], {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Worker process: train the replica of the network on the patterns sent by the coordinator, and leave the accumulated
+# weight changes in its slot of shared memory
+def _worker(network, specs, worker_id, pipe):
+    # Shared memory blocks of the coordinator, open as long as the worker runs
+    blocks = []
+
+    def attach(name, shape):
+        shm, array = shared.attach(name, shape)
+        blocks.append(shm)
+        return array
+
+    inputs = {name: attach(*spec) for name, spec in specs['inputs'].items()}
+    outputs = {name: attach(*spec) for name, spec in specs['outputs'].items()}
+    dwt_slots = [attach(*spec)[worker_id] for spec in specs['dwt']]
+    for projection, (wt_name, fwt_name, shape) in zip(network.projections, specs['weights']):
+        _use_weights(projection, attach(wt_name, shape), attach(fwt_name, shape))
+        # Only accumulate the weight changes: the coordinator applies them
+        projection.wt_update_interval = float('inf')
+        projection.dwt[...] = 0.0
+        projection.dwt_count = 0
+    if network.plan is not None:
+        network.plan.compile()
+
+    while True:
+        command, shard = pipe.recv()
+        if command == 'stop':
+            break
+
+        sse = 0.0
+        for i in shard:
+            network.set_inputs({name: acts[i] for name, acts in inputs.items()})
+            network.set_outputs({name: acts[i] for name, acts in outputs.items()})
+            sse += network.cycle()
+
+        # Hand over the accumulated weight changes
+        for projection, slot in zip(network.projections, dwt_slots):
+            slot[...] = projection.dwt
+            projection.dwt[...] = 0.0
+            projection.dwt_count = 0
+
+        pipe.send(sse)
@@ -0,0 +1,23 @@
+"""
+
+Arrays in shared memory, for the worker processes of data-parallel training and sweeps
+
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Allocate a shared memory block holding a copy of array. Returns the block, and the array backed by it
+def share(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, shared
+
+
+# Array backed by the shared memory block of the given name
+def attach(name, shape, dtype=float):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
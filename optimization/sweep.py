@@ -0,0 +1,243 @@
+"""
+
+Hyperparameter sweeps
+
+Configurations are dicts of parameter overrides, applied to a freshly built network:
+    'quarter_size'          parameter of the network
+    'V1.inhib_gain'         parameter of a layer, or of its neurons ('V1.act_gain')
+    'LGN_ON->V1.lrate'      parameter of the projection between two layers
+Every configuration is trained on the same patterns in a pool of processes, and successive halving keeps only the
+best configurations (lowest SSE) for longer training
+
+"""
+
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from . import shared
+
+
+################  Search spaces  ################
+
+
+# Every combination of the values of a grid {parameter: list of values}
+def grid(space):
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+# n random configurations of a space {parameter: values}, where values are a list to choose from, a (low, high) range
+# (integers if both bounds are integers), or a function of a numpy Generator
+def random_space(space, n, seed=None):
+    rng = np.random.default_rng(seed)
+
+    def sample(values):
+        if callable(values):
+            return values(rng)
+        if isinstance(values, tuple):
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                return int(rng.integers(low, high + 1))
+            return float(rng.uniform(low, high))
+        return values[rng.integers(len(values))]
+
+    return [{key: sample(values) for key, values in space.items()} for _ in range(n)]
+
+
+# Projection parameters only used when the projection is created: the connections and weights of a projection are
+# created again when one of them is overridden
+_init_params = ('proj', 'rf_size', 'rf_shape', 'rf_stride', 'lat_radius', 'lat_self', 'lat_sigma', 'fan_in', 'rnd_type',
+                'rnd_mean', 'rnd_var', 'seed', 'sig_off', 'sig_gain', 'kernel_size', 'conv_stride', 'conv_pad')
+
+
+# Set the parameters of a configuration on the network, and build it again
+def apply_overrides(network, config):
+    reinit = []
+    for key, value in config.items():
+        target, _, name = key.rpartition('.')
+
+        # Network parameter
+        if not target:
+            owner = network
+        # Projection parameter
+        elif '->' in target:
+            pre, post = target.split('->')
+            owner = next((p for p in network.projections if p.pre.name == pre and p.post.name == post), None)
+            if owner is None:
+                raise ValueError('No projection from {} to {}'.format(pre, post))
+            if name == 'proj' and 'conv' in (owner.proj, value):
+                raise ValueError('{}: convolutional projections are a different class'.format(key))
+            if name in _init_params and owner not in reinit:
+                reinit.append(owner)
+        # Layer parameter, or parameter of the neurons of the layer
+        else:
+            owner = network._get_layer(target)
+            if not hasattr(owner, name):
+                owner = owner.unit
+
+        assert hasattr(owner, name), key
+        setattr(owner, name, value)
+
+    # Same random generator state as a projection created with the new parameters
+    for projection in reinit:
+        projection.rng = np.random.default_rng(projection.seed)
+        projection.projection_init()
+        projection.dwt_count = 0
+
+    network.build()
+    return network
+
+
+################  Sweep  ################
+
+
+# Successive halving over configurations: every rung trains the remaining configurations for eta times more epochs
+# than the previous one, then keeps the best 1/eta of them
+class Sweep:
+
+    def __init__(self, build, configs, inputs, outputs, **kwargs):
+
+        # Function returning a new network. Must be picklable (a module-level function) to run in the workers
+        self.build = build
+        # Configurations: dicts of parameter overrides (see grid and random_space)
+        self.configs = list(configs)
+        # Patterns: dicts of layer name -> (patterns, layer size) arrays
+        self.inputs = {name: np.asarray(acts, dtype=float) for name, acts in inputs.items()}
+        self.outputs = {name: np.asarray(acts, dtype=float) for name, acts in outputs.items()}
+
+        ########### Parameters ###########
+
+        # Number of worker processes, one per core by default
+        self.n_workers = None
+        # Epochs of training of every configuration in the first rung
+        self.min_epochs = 1
+        # Pruning factor: only the best 1/eta of the configurations go on to the next rung, trained eta times longer
+        self.eta = 3
+        # Maximum number of rungs, None to go on until one configuration remains
+        self.max_rungs = None
+        # File to which the result of every training run is appended as a JSON line, as soon as it completes
+        self.results_path = None
+
+        for key, value in kwargs.items():
+            assert hasattr(self, key)
+            setattr(self, key, value)
+
+        # With eta < 2, nothing is ever pruned and the later rungs train for no epochs
+        if self.eta < 2:
+            raise ValueError('eta must be at least 2, got {}'.format(self.eta))
+
+        # Result of every training run: config, rung, epochs, sse, time
+        self.results = []
+        # Network trained with the best configuration of the last rung
+        self.best_network = None
+
+    # Run the sweep. Returns the (sse, config) pairs of the configurations of the last rung, best first
+    def run(self):
+        # The patterns are shared read-only with the workers instead of being sent with every task
+        blocks = []
+        specs = {}
+        for kind, patterns in (('inputs', self.inputs), ('outputs', self.outputs)):
+            specs[kind] = {}
+            for name, acts in patterns.items():
+                shm, _ = shared.share(acts)
+                blocks.append(shm)
+                specs[kind][name] = (shm.name, acts.shape)
+
+        try:
+            with ProcessPoolExecutor(self.n_workers, initializer=_init_worker, initargs=(self.build, specs)) as pool:
+                return self._successive_halving(pool)
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def _successive_halving(self, pool):
+        alive = list(range(len(self.configs)))
+        networks = [None] * len(self.configs)
+        epochs_done = [0] * len(self.configs)
+        sse = {}
+
+        rung = 0
+        while True:
+            # Train the remaining configurations up to the epochs of this rung, continuing from the previous rung
+            epochs = self.min_epochs * self.eta ** rung
+            futures = {pool.submit(_train, networks[i], self.configs[i], epochs - epochs_done[i]): i for i in alive}
+            for future in as_completed(futures):
+                i = futures[future]
+                networks[i], sse[i], elapsed = future.result()
+                epochs_done[i] = epochs
+                self._record(dict(config=self.configs[i], rung=rung, epochs=epochs, sse=sse[i], time=elapsed))
+
+            # Lowest SSE first, failed (NaN) configurations last
+            alive.sort(key=lambda i: sse[i] if np.isfinite(sse[i]) else np.inf)
+            rung += 1
+            if len(alive) <= 1 or (self.max_rungs is not None and rung >= self.max_rungs):
+                break
+
+            # Prune, and free the networks of the pruned configurations
+            for i in alive[max(1, len(alive) // self.eta):]:
+                networks[i] = None
+            alive = alive[:max(1, len(alive) // self.eta)]
+
+        self.best_network = networks[alive[0]]
+        return [(sse[i], self.configs[i]) for i in alive]
+
+    # Keep the result of a training run, and append it to the results file
+    def _record(self, result):
+        self.results.append(result)
+        if self.results_path is not None:
+            with open(self.results_path, 'a') as f:
+                f.write(json.dumps(result, default=_json_default) + '\n')
+
+
+# Numpy values in the results
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+################  Workers  ################
+
+
+# Function building the networks, and patterns in shared memory, of the worker process
+_build = None
+_patterns = {}
+_blocks = []
+
+
+# Attach the worker process to the shared patterns
+def _init_worker(build, specs):
+    global _build
+    _build = build
+    for kind, arrays in specs.items():
+        _patterns[kind] = {}
+        for name, (shm_name, shape) in arrays.items():
+            shm, acts = shared.attach(shm_name, shape)
+            _blocks.append(shm)
+            _patterns[kind][name] = acts
+
+
+# Train a network for the given number of epochs, building it for config if it is None. Returns the network, the mean
+# SSE of the last epoch and the training time
+def _train(network, config, epochs):
+    start = time.time()
+    if network is None:
+        network = apply_overrides(_build(), config)
+
+    inputs, outputs = _patterns['inputs'], _patterns['outputs']
+    n_patterns = len(next(iter(inputs.values())))
+    sse = np.nan
+    for _ in range(epochs):
+        sse = 0.0
+        for i in range(n_patterns):
+            network.set_inputs({name: acts[i] for name, acts in inputs.items()})
+            network.set_outputs({name: acts[i] for name, acts in outputs.items()})
+            sse += network.cycle()
+        sse = float(sse / n_patterns)
+
+    return network, sse, time.time() - start
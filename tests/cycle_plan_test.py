@@ -0,0 +1,82 @@
+"""
+
+The fused cycle plan against step by step execution: both must give the same states and weights, including when the
+network is changed after it is built
+
+"""
+
+import numpy as np
+import pytest
+
+from architecture import connection, NEXUS
+from architecture.layer import Layer
+from architecture.neuron import INPUT, HIDDEN, OUTPUT
+
+
+def make_network(**kwargs):
+    layers = [Layer(16, neuron_type=INPUT, name='in'), Layer(9, neuron_type=HIDDEN, name='hid'),
+              Layer(4, neuron_type=OUTPUT, name='out')]
+    projections = [connection.Projection(layers[0], layers[1], seed=1),
+                   connection.Projection(layers[1], layers[2], seed=2),
+                   connection.Projection(layers[2], layers[1], seed=3, wt_scale_rel=0.3)]
+    return NEXUS.Network(layers, projections, **kwargs)
+
+
+# Train on the patterns, calling change(network) after the first cycle
+def train(network, n_cycles=4, change=None):
+    rng = np.random.default_rng(0)
+    inputs, outputs = rng.uniform(0, 1, (n_cycles, 16)), rng.uniform(0, 1, (n_cycles, 4))
+    sse = []
+    for i in range(n_cycles):
+        network.set_inputs({'in': inputs[i]})
+        network.set_outputs({'out': outputs[i]})
+        sse.append(network.cycle())
+        if i == 0 and change is not None:
+            change(network)
+    return sse
+
+
+def assert_same(stepped, fused):
+    for a, b in zip(stepped.layers, fused.layers):
+        for name in ('act', 'v_m', 'v_m_eq', 'avg_s', 'avg_m', 'avg_l', 'act_m'):
+            np.testing.assert_allclose(getattr(a, name), getattr(b, name), rtol=0, atol=1e-12, err_msg=name)
+        assert a.step_count == b.step_count
+    for a, b in zip(stepped.projections, fused.projections):
+        np.testing.assert_allclose(a.wt, b.wt, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'n_threads': 2}, {'settle_tol': 1e-3}])
+def test_fused_matches_stepped(kwargs):
+    stepped, fused = make_network(**kwargs), make_network(fused=True, **kwargs)
+    np.testing.assert_allclose(train(stepped), train(fused), rtol=0, atol=1e-12)
+    assert_same(stepped, fused)
+
+
+def test_parameter_change_after_build():
+    def change(network):
+        network.layers[1].unit.act_gain = 80
+        network.layers[1].unit.g_bar_l = 0.2
+
+    stepped, fused = make_network(), make_network(fused=True)
+    train(stepped, change=change)
+    train(fused, change=change)
+    assert_same(stepped, fused)
+
+
+def test_layer_added_after_build():
+    def change(network):
+        network.add_layer(Layer(5, neuron_type=HIDDEN, name='extra'))
+
+    stepped, fused = make_network(), make_network(fused=True)
+    train(stepped, change=change)
+    train(fused, change=change)
+    assert fused.layers[-1].step_count == 3 * 4 * fused.quarter_size
+    assert_same(stepped, fused)
+
+
+def test_fused_set_after_construction():
+    stepped, fused = make_network(), make_network()
+    fused.fused = True
+    train(stepped)
+    train(fused)
+    assert_same(stepped, fused)
@@ -0,0 +1,66 @@
+"""
+
+The vectorized layer against the per-neuron model: stepping a Layer must give the same states as stepping one Neuron
+object per neuron
+
+"""
+
+import numpy as np
+import pytest
+
+from architecture import neuron
+from architecture.layer import Layer
+
+
+compared = ('g_e', 'I_net', 'I_net_r', 'v_m', 'v_m_eq', 'act', 'act_nd', 'adapt_curr', 'avg_ss', 'avg_s', 'avg_m',
+            'avg_s_eff')
+
+
+# Step a layer and one Neuron per neuron of the layer on the same inputs, the Neurons receiving the inhibition of the
+# layer, and compare their states after every step
+def run_both(size, inputs, clamped=None):
+    layer = Layer(size, neuron_type=neuron.HIDDEN)
+    layer.reset_neurons()
+    neurons = [neuron.Neuron(neuron_type=neuron.HIDDEN, log_names=()) for _ in range(size)]
+
+    if clamped is not None:
+        for i, act_ext in clamped.items():
+            layer.force_activity_at(i, act_ext)
+            neurons[i].force_activity(act_ext)
+
+    for step_inputs in inputs:
+        for i, n in enumerate(neurons):
+            if n.act_ext is None:
+                layer.net_raw_input[i] += step_inputs[i]
+                n.add_excitatory(step_inputs[i])
+        layer.step('minus')
+
+        for n in neurons:
+            n.calculate_net_input()
+            n.step('minus', g_i=layer.gc_i)
+
+        for name in compared:
+            np.testing.assert_allclose(getattr(layer, name), [getattr(n, name) for n in neurons], rtol=1e-12,
+                                       atol=1e-12, err_msg=name)
+    return layer
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_layer_matches_neurons(seed):
+    rng = np.random.default_rng(seed)
+    layer = run_both(12, rng.uniform(0, 1, (40, 12)))
+    # The inputs are strong enough to make neurons fire
+    assert layer.act.max() > 0.1
+
+
+def test_clamped_neurons_match():
+    rng = np.random.default_rng(3)
+    run_both(8, rng.uniform(0, 1, (30, 8)), clamped={0: 0.9, 3: 0.0, 5: 0.4})
+
+
+def test_neuron_view_step_points_to_layer():
+    layer = Layer(4)
+    with pytest.raises(TypeError, match='Layer.step'):
+        layer.neurons[0].step('minus')
+    with pytest.raises(TypeError, match='Layer.step'):
+        layer.neurons[0].calculate_net_input()
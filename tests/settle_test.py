@@ -0,0 +1,53 @@
+"""
+
+Early termination of the settling: settle_max_steps caps every quarter, with or without settle_tol, in cycles and in
+inference
+
+"""
+
+import numpy as np
+import pytest
+
+from architecture import connection, NEXUS
+from architecture.layer import Layer
+from architecture.neuron import INPUT, HIDDEN, OUTPUT
+
+
+def make_network(**kwargs):
+    layers = [Layer(16, neuron_type=INPUT, name='in'), Layer(9, neuron_type=HIDDEN, name='hid'),
+              Layer(4, neuron_type=OUTPUT, name='out')]
+    projections = [connection.Projection(layers[0], layers[1], seed=1),
+                   connection.Projection(layers[1], layers[2], seed=2)]
+    return NEXUS.Network(layers, projections, **kwargs)
+
+
+patterns = np.random.default_rng(0).uniform(0, 1, (2, 16))
+
+
+@pytest.mark.parametrize('fused', [False, True])
+@pytest.mark.parametrize('settle_tol', [None, 1e-12])
+def test_max_steps_caps_every_quarter(fused, settle_tol):
+    network = make_network(fused=fused, settle_tol=settle_tol, settle_max_steps=10)
+    network.set_inputs({'in': patterns[0]})
+    network.set_outputs({'out': np.full(4, 0.5)})
+    network.cycle()
+    assert network.cycle_steps == 4 * 10
+    assert network.layers[1].step_count == 4 * 10
+
+
+@pytest.mark.parametrize('fused', [False, True])
+@pytest.mark.parametrize('settle_tol', [None, 1e-12])
+def test_max_steps_caps_every_quarter_of_infer(fused, settle_tol):
+    network = make_network(fused=fused, settle_tol=settle_tol, settle_max_steps=10)
+    network.infer({'in': patterns[0]})
+    assert network.cycle_steps == 3 * 10
+
+    network.infer({'in': patterns[1]}, n_steps=network.quarter_size)
+    assert network.cycle_steps == 10
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_infer_without_cap_runs_the_minus_phase(fused):
+    network = make_network(fused=fused)
+    network.infer({'in': patterns[0]})
+    assert network.cycle_steps == 3 * network.quarter_size
@@ -0,0 +1,65 @@
+"""
+
+Stepping with a thread pool: results must not depend on the number of threads, and networks that have used their pool
+must keep working after a layer is added, or in forked worker processes
+
+"""
+
+import numpy as np
+import pytest
+
+from architecture import connection, NEXUS
+from architecture.layer import Layer
+from architecture.neuron import INPUT, HIDDEN, OUTPUT
+from optimization.data_parallel import DataParallelTrainer
+
+
+def make_network(**kwargs):
+    layers = [Layer(16, neuron_type=INPUT, name='in'), Layer(9, neuron_type=HIDDEN, name='hid'),
+              Layer(4, neuron_type=OUTPUT, name='out')]
+    projections = [connection.Projection(layers[0], layers[1], seed=1),
+                   connection.Projection(layers[1], layers[2], seed=2),
+                   connection.Projection(layers[2], layers[1], seed=3)]
+    return NEXUS.Network(layers, projections, **kwargs)
+
+
+rng = np.random.default_rng(0)
+inputs, outputs = rng.uniform(0, 1, (8, 16)), rng.uniform(0, 1, (8, 4))
+
+
+def train(network, order):
+    for i in order:
+        network.set_inputs({'in': inputs[i]})
+        network.set_outputs({'out': outputs[i]})
+        network.cycle()
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_layer_added_after_threaded_steps(fused):
+    serial, threaded = make_network(fused=fused), make_network(fused=fused, n_threads=2)
+    for network in (serial, threaded):
+        train(network, [0])
+        extra = Layer(5, neuron_type=HIDDEN, name='extra')
+        network.add_layer(extra)
+        network.add_connection(connection.Projection(network.layers[1], extra, seed=4))
+        train(network, [1, 2])
+
+    assert threaded.layers[-1].step_count == serial.layers[-1].step_count
+    for a, b in zip(serial.layers, threaded.layers):
+        np.testing.assert_array_equal(a.act, b.act)
+
+
+# A worker forked from a network that has created its thread pool must not use the copy of the pool, which has no
+# threads. One worker, syncing after every pattern, trains exactly like serial training in the same order
+def test_threaded_network_in_forked_worker():
+    serial, parallel = make_network(n_threads=2), make_network(n_threads=2)
+    for network in (serial, parallel):
+        train(network, [0])
+    assert parallel._pool is not None
+
+    train(serial, np.random.default_rng(5).permutation(len(inputs)))
+    with DataParallelTrainer(parallel, {'in': inputs}, {'out': outputs}, n_workers=1, seed=5) as trainer:
+        trainer.train(1)
+
+    for a, b in zip(serial.projections, parallel.projections):
+        np.testing.assert_array_equal(a.wt, b.wt)
@@ -35,7 +35,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.graphWidget.setBackground('w')
         for name in names:
-            self.plot(range(len(data[name])), data[name], name, colors[names.index(name)])
+            self.plot(data[name].times(), data[name].values(), name, colors[names.index(name)])
 
     def plot(self, x, y, plotname, color):
         pen = pg.mkPen(color=color, width=5)
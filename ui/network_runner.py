@@ -1,6 +1,4 @@
 from architecture import neuron, layer, connection, NEXUS
-import random
-random.seed(2)
 import numpy as np
 
 class network_runner:
@@ -16,6 +14,9 @@ class network_runner:
         self.projections = []
         self.network = None
 
+        # Seed of the weight initialization. Each projection gets its own seed, derived from this one
+        self.seed = 2
+
 
     ################  Layer control  ################
 
@@ -63,7 +64,8 @@ class network_runner:
                 receiving_layer = i
 
         if sending_layer is not None and receiving_layer is not None:
-            newProjection = connection.Projection(sending_layer, receiving_layer)
+            newProjection = connection.Projection(sending_layer, receiving_layer,
+                                                  seed=self.seed + len(self.projections))
             self.projections.append(newProjection)
         else:
             print("projection layer arguments error")
@@ -88,13 +90,11 @@ class network_runner:
     ################  Train/test  ################
     
     
-    # Test the network with one additional cycle
+    # Test the network on an input pattern, inference only. input_pattern can also be a (batch, units) array of patterns
     def test_network(self, input_pattern):
-        assert len(self.network.layers[0].neurons) == len(input_pattern)
-        self.network.set_inputs({'input_layer': input_pattern})
+        assert len(self.network.layers[0].neurons) == np.shape(input_pattern)[-1]
     
-        self.network.cycle()
-        return [neuron.act_m for neuron in self.network.layers[-1].neurons]
+        return self.network.infer({'input_layer': input_pattern}).tolist()
     
     
     # Run one cycle for the network
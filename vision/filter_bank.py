@@ -0,0 +1,154 @@
+"""
+
+Fixed early vision front end
+
+A bank of Gabor filters (several orientations and wavelengths) and difference of gaussians filters, applied to images
+or batches of images by FFT convolution. The feature maps are resized to the shape of an input layer, ready to clamp
+
+"""
+
+import numpy as np
+import scipy.fft
+import skimage.transform
+
+
+################  Kernels  ################
+
+
+# Coordinates (x, y) of the pixels of a size x size kernel, centered
+def _grid(size):
+    r = np.arange(size) - (size - 1) / 2
+    return np.meshgrid(r, r, indexing='ij')
+
+
+# Gabor kernel: a sinusoid of the given wavelength along orientation theta (radians), under a gaussian envelope of
+# width sigma (about one octave of bandwidth by default), elongated across the sinusoid by 1 / gamma. Zero mean, unit
+# norm: uniform regions give no response
+def gabor(size, wavelength, theta, sigma=None, gamma=0.5, phase=0.0):
+    sigma = 0.56 * wavelength if sigma is None else sigma
+    x, y = _grid(size)
+    u = x * np.cos(theta) + y * np.sin(theta)
+    v = -x * np.sin(theta) + y * np.cos(theta)
+    g = np.exp(-(u ** 2 + gamma ** 2 * v ** 2) / (2 * sigma ** 2)) * np.cos(2 * np.pi * u / wavelength + phase)
+    g -= g.mean()
+    return g / np.linalg.norm(g)
+
+
+# On-center, off-surround difference of gaussians kernel
+def dog(size, sigma1, sigma2):
+    x, y = _grid(size)
+    r2 = x ** 2 + y ** 2
+    return (np.exp(-r2 / (2 * sigma1 ** 2)) / (2 * np.pi * sigma1 ** 2)
+            - np.exp(-r2 / (2 * sigma2 ** 2)) / (2 * np.pi * sigma2 ** 2))
+
+
+# Odd size covering 3 standard deviations on each side
+def _kernel_size(sigma):
+    return 2 * int(np.ceil(3 * sigma)) + 1
+
+
+################  Filter bank  ################
+
+
+class FilterBank:
+
+    def __init__(self, **kwargs):
+
+        ########### Gabor filters ###########
+
+        # Number of orientations, evenly spread over 180 degrees
+        self.orientations = 4
+        # Wavelengths (pixels) of the sinusoids, one scale per wavelength
+        self.wavelengths = (4, 8)
+        # Aspect ratio of the gaussian envelope
+        self.gamma = 0.5
+        # Phase of the sinusoids: 0 for even (bar) filters, pi / 2 for odd (edge) filters
+        self.phase = 0.0
+
+        ########### Difference of gaussians filters ###########
+
+        # (center sigma, surround sigma) of every difference of gaussians
+        self.dog_sigmas = ((2, 3),)
+
+        ########### Output ###########
+
+        # Shape (rows, cols) the feature maps are resized to
+        self.shape = (12, 12)
+        # Split every feature map into its positive (ON) and negative (OFF) parts, so that activities are >= 0
+        self.rectify = True
+
+        for key, value in kwargs.items():
+            assert hasattr(self, key)
+            setattr(self, key, value)
+
+        # (filters, size, size) kernels, all zero-padded to the largest size
+        self.kernels = self._make_kernels()
+        self.kernels.flags.writeable = False
+        # FFT plans: spectrum of the kernels for each image shape (rows, cols)
+        self._plans = {}
+
+    def _make_kernels(self):
+        specs = []
+        for wavelength in self.wavelengths:
+            size = _kernel_size(0.56 * wavelength)
+            for theta in np.arange(self.orientations) * np.pi / self.orientations:
+                specs.append(gabor(size, wavelength, theta, gamma=self.gamma, phase=self.phase))
+        for sigma1, sigma2 in self.dog_sigmas:
+            specs.append(dog(_kernel_size(max(sigma1, sigma2)), sigma1, sigma2))
+
+        size = max(k.shape[0] for k in specs)
+        kernels = np.zeros((len(specs), size, size))
+        for i, k in enumerate(specs):
+            pad = (size - k.shape[0]) // 2
+            kernels[i, pad:pad + k.shape[0], pad:pad + k.shape[0]] = k
+        return kernels
+
+    # Number of feature maps of the output
+    @property
+    def n_maps(self):
+        return len(self.kernels) * (2 if self.rectify else 1)
+
+    # Geometry (maps, rows, cols) of a layer taking the output of the bank as input
+    @property
+    def geometry(self):
+        return (self.n_maps,) + tuple(self.shape)
+
+    # FFT plan of an image shape: the padded shape of the transforms, and the spectrum of the kernels at that shape
+    def _plan(self, image_shape):
+        plan = self._plans.get(image_shape)
+        if plan is None:
+            size = self.kernels.shape[-1]
+            fft_shape = tuple(scipy.fft.next_fast_len(n + size - 1, real=True) for n in image_shape)
+            plan = fft_shape, scipy.fft.rfft2(self.kernels, s=fft_shape)
+            self._plans[image_shape] = plan
+        return plan
+
+    # Full-resolution responses (..., filters, rows, cols) of an image (rows, cols) or a batch of images
+    # (..., rows, cols), same size as the images
+    def responses(self, images):
+        images = np.asarray(images, dtype=float)
+        rows, cols = images.shape[-2:]
+        fft_shape, kernels_fft = self._plan((rows, cols))
+
+        # One transform per image, multiplied by the spectrum of every kernel
+        spectrum = scipy.fft.rfft2(images, s=fft_shape)[..., np.newaxis, :, :] * kernels_fft
+        full = scipy.fft.irfft2(spectrum, s=fft_shape)
+        start = (self.kernels.shape[-1] - 1) // 2
+        return full[..., start:start + rows, start:start + cols]
+
+    # Feature maps (..., maps, rows, cols) of the images, resized to shape
+    def apply(self, images):
+        maps = self.responses(images)
+        maps = skimage.transform.resize(maps, maps.shape[:-2] + tuple(self.shape))
+        if self.rectify:
+            maps = np.concatenate((np.maximum(maps, 0), np.maximum(-maps, 0)), axis=-3)
+        return maps
+
+    # Activities (..., layer size) of a layer of the bank's geometry, feature maps stacked in order
+    def activities(self, images):
+        maps = self.apply(images)
+        return maps.reshape(maps.shape[:-3] + (-1,))
+
+    # Input map {layer name: activities} of an image, to clamp the layer with
+    def pattern(self, image, layer_name):
+        return {layer_name: self.activities(image)}
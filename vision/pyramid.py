@@ -0,0 +1,150 @@
+"""
+
+Multi-scale image pyramids
+
+Every level of a pyramid halves the resolution of the previous one by averaging blocks of 2 x 2 pixels. Any resolution
+is then resized from the closest level above it, instead of from the full image. Pyramids are cached per source image,
+within a bound on memory, so that inputs of several resolutions are computed from one decode of the image
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+import numpy as np
+import skimage.transform
+
+
+################  Pyramids  ################
+
+
+# Image (rows, cols), or stack of images (..., rows, cols), at half resolution: mean of 2 x 2 blocks. An odd last row or
+# column is dropped
+def decimate(image):
+    rows, cols = image.shape[-2] // 2 * 2, image.shape[-1] // 2 * 2
+    image = image[..., :rows, :cols]
+    return 0.25 * (image[..., 0::2, 0::2] + image[..., 1::2, 0::2] + image[..., 0::2, 1::2] + image[..., 1::2, 1::2])
+
+
+# Levels of the pyramid of an image: the image, then halved until a side would be smaller than min_size, or levels
+# levels are built
+def pyramid(image, min_size=8, levels=None):
+    image = np.asarray(image, dtype=float)
+    result = [image]
+    while min(result[-1].shape[-2:]) // 2 >= min_size and (levels is None or len(result) < levels):
+        result.append(decimate(result[-1]))
+    return result
+
+
+# Smallest level of the pyramid with at least shape (rows, cols)
+def level_for(levels, shape):
+    for level in reversed(levels):
+        if level.shape[-2] >= shape[0] and level.shape[-1] >= shape[1]:
+            return level
+    return levels[0]
+
+
+# Image of the pyramid at shape (rows, cols), resized from the closest level
+def resize(levels, shape):
+    level = level_for(levels, shape)
+    if level.shape[-2:] == tuple(shape):
+        return level
+    return skimage.transform.resize(level, level.shape[:-2] + tuple(shape))
+
+
+################  Cache  ################
+
+
+# Pyramids of source images, computed by load(source) (an array), kept for the most recently used sources as long as
+# they take at most max_bytes. Safe to share between threads
+class PyramidCache:
+
+    def __init__(self, load, **kwargs):
+
+        # Function of a source (a file name...) returning the image to build the pyramid of
+        self.load = load
+
+        ########### Parameters ###########
+
+        # Memory bound of the cached pyramids, in bytes
+        self.max_bytes = 256 * 2 ** 20
+        # Smallest side of the levels
+        self.min_size = 8
+
+        for key, value in kwargs.items():
+            assert hasattr(self, key)
+            setattr(self, key, value)
+
+        # Pyramids by source, least recently used first, and their total size
+        self._pyramids = OrderedDict()
+        self.nbytes = 0
+        # Pyramids being built, by source: threads asking for them wait for the one building them
+        self._building = {}
+        self._lock = Lock()
+
+        # Number of lookups found in the cache (or being built), and not found (a decode of the source)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._pyramids)
+
+    def __contains__(self, source):
+        return source in self._pyramids
+
+    # Levels of the pyramid of a source, built if it is not in the cache. Every source is loaded by one thread at a time
+    def get(self, source):
+        with self._lock:
+            levels = self._pyramids.get(source)
+            if levels is not None:
+                self._pyramids.move_to_end(source)
+                self.hits += 1
+                return levels
+
+            # Another thread is building it
+            building = self._building.get(source)
+            if building is None:
+                self.misses += 1
+                future = self._building[source] = Future()
+            else:
+                self.hits += 1
+        if building is not None:
+            return building.result()
+
+        # Built outside the lock: other sources can be read meanwhile
+        try:
+            levels = pyramid(self.load(source), self.min_size)
+        except BaseException as error:
+            with self._lock:
+                del self._building[source]
+            future.set_exception(error)
+            raise
+        for level in levels:
+            level.flags.writeable = False
+
+        with self._lock:
+            del self._building[source]
+            self._pyramids[source] = levels
+            self.nbytes += sum(level.nbytes for level in levels)
+            self._evict()
+        future.set_result(levels)
+        return levels
+
+    # Image of a source at shape (rows, cols), or a dict of images by shape for several shapes
+    def resize(self, source, shape):
+        levels = self.get(source)
+        if np.ndim(shape[0]) == 0:
+            return resize(levels, shape)
+        return {tuple(s): resize(levels, s) for s in shape}
+
+    # Drop the least recently used pyramids until the cache fits in max_bytes. The last one added is always kept
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._pyramids) > 1:
+            _, levels = self._pyramids.popitem(last=False)
+            self.nbytes -= sum(level.nbytes for level in levels)
+
+    def clear(self):
+        with self._lock:
+            self._pyramids.clear()
+            self.nbytes = 0